@@ -1,93 +1,395 @@
-import ollama
+import asyncio
+import hashlib
+import json
 import os
 import requests
-from bs4 import BeautifulSoup
+import threading
+import time
 from dotenv import load_dotenv
 from config import config
-from .generate_detr import generate_bounding_box_caption, model, processor
-from .generate_gguf import generate_gguf_stream
-from .utils import check_if_vision_mode, dictate_ollama_stream, remove_parentheses, speak
+from .camera import camera
+from .context import ConversationContext
+from .cpu_budget import cpu_budget
+from .generate_detr import generate_bounding_box_caption
+from .generate_gguf import LlavaServer, generate_gguf_stream
+from .warmup import ModelWarmup
+from .intents import intent_router
+from .model_registry import model_registry, ollama_model_mb, process_rss_mb
+from .response_cache import response_cache
+from .tracing import tracer
+from .vision_cache import vision_cache
+from .utils import dictate_ollama_stream, dictate_stream, dictate_stream_async, remove_parentheses, say_locally, speak
+# sentence_stoppers moved to utils, re-exported for code that still imports it from here
+from .utils import sentence_stoppers  # noqa: F401
 load_dotenv()
 
-message_history = [{
-    'role': 'user',
-    'content': config['SYSTEM_PROMPT'],
-}]
+def register_llava_server(server):
+    """
+    Let the model registry start and stop the moondream server as memory allows.
+    """
+    model_registry.register('moondream', load=server.start, unload=server.stop,
+                            size_mb=config['MODEL_SIZE_MB']['moondream'],
+                            measure=lambda: process_rss_mb(server.process.pid) if server.process else None)
+    return server
+
+
+llava_server = None
+if config["VISION_MODEL"] == 'moondream' and config["LLAVA_SERVER"]:
+    llava_server = register_llava_server(LlavaServer(llama_cpp_path=config["LLAMA_CPP_PATH"],
+                                                     model_path=config["MOONDREAM_MODEL_PATH"],
+                                                     mmproj_path=config["MOONDREAM_MMPROJ_PATH"],
+                                                     port=config["LLAVA_SERVER_PORT"],
+                                                     threads=cpu_budget.threads("vision", base=True),
+                                                     preexec_fn=cpu_budget.preexec("vision")))
+
+message_history = ConversationContext(config['SYSTEM_PROMPT'],
+                                      token_budget=config['CONTEXT_TOKEN_BUDGET'],
+                                      max_messages=config['MAX_HISTORY_MESSAGES'])
+
 
-sentence_stoppers = ['. ', '.\n', '? ', '! ', '?\n', '!\n', '.\n']
+model_warmup = ModelWarmup(config['LOCAL_MODEL'],
+                           keep_alive=config['OLLAMA_KEEP_ALIVE'],
+                           options=cpu_budget.ollama_options())
+model_registry.register('llm', load=lambda: model_warmup.warm(background=False), unload=model_warmup.unload,
+                        size_mb=config['MODEL_SIZE_MB']['llm'],
+                        measure=lambda: ollama_model_mb(model_warmup.model_name))
 
 
-def preload_model(model_name="llama3:instruct"):
+def preload_model(model_name="llama3:instruct", background=True):
+    """
+    Load the model into Ollama. By default this runs in the background so startup isn't blocked.
+    """
     print("Preparing model...")
-    os.system(
-        f"curl http://localhost:11434/api/chat -d '{{\"model\": \"{model_name}\"}}'")
+    model_warmup.model_name = model_name
+    model_registry.warm('llm', background=background)
+    return model_warmup
+
 
-    print("Model preloaded.")
-    return
+def rewarm_model():
+    """
+    Reload the LLM if it has gone idle, or through the registry if it was evicted, so the reload
+    still counts against the memory budget.
+    """
+    if model_registry.models['llm'].loaded:
+        model_warmup.rewarm()
+    else:
+        model_registry.warm('llm')
 
 
-def get_llm_response(transcription, message_history, model_name='llama3:instruct', use_rag=True):
+async def get_llm_response_async(transcription, message_history, model_name='llama3:instruct', use_rag=True,
+                                 intent=None, say=say_locally, cancelled=None):
+    """
+    Answer a command. The RAG fetch runs while its announcement is spoken, and the
+    reply is streamed from ollama.AsyncClient into the speech queue. If the task is cancelled
+    (barge-in), whatever was generated so far is still recorded in the message history, and if
+    nothing was the question is taken back out so the history doesn't end on an unanswered turn.
+    `say(text, cache)` speaks a sentence, so a hub can send the reply to a satellite instead.
+    `cancelled` is the turn's threading.Event, handed to handlers that reply from a thread.
+    """
     print("Here's what you said: ", transcription)
     transcription = remove_parentheses(transcription)
-    if use_rag:
-        # Experimental idea for supplmenting with external data. Tool use may be better but this could start.
-        if 'weather' in transcription:
-            speak("Getting weather data.")
-            message_history = add_in_weather_data(
-                message_history, transcription)
-        elif check_if_vision_mode(transcription):
-            speak("Taking a picture.")
-            response, message_history = generate_image_response(
-                message_history, transcription)
-            return response, message_history
-        elif "news" in transcription:
-            speak("Getting news data.")
-            message_history = add_in_news_data(message_history, transcription)
-
-        else:
-            message_history.append({
-                'role': 'user',
-                'content': transcription,
-            })
+    if use_rag and intent is None:
+        intent = intent_router.route(transcription)
+    handler = intent_router.handler(intent) if use_rag else None
+    if handler is not None and handler.responds:
+        if handler.announcement:
+            await say(handler.announcement, True)
+        return await asyncio.to_thread(handler.function, message_history, transcription, cancelled=cancelled)
+    elif handler is not None:
+        _, message_history = await asyncio.gather(
+            say(handler.announcement or "", True),
+            asyncio.to_thread(handler.function, message_history, transcription))
     else:
         message_history.append({
             'role': 'user',
             'content': transcription,
         })
 
-    if config['CONDENSE_MESSAGES'] and len(message_history) > config['TRAILING_MESSAGE_COUNT'] + 1:
-        # remove all but the first and last n messages
-        msg_history = message_history[:1] + \
-            message_history[-config['TRAILING_MESSAGE_COUNT']:]
+    parts = []
+    cached = None
+    acquiring = None
+    finished = False
+    context = response_context(model_name, intent if use_rag else None, message_history)
+
+    async def text_chunks():
+        nonlocal finished
+        if cached is not None:
+            # a repeated question, straight to speech
+            tracer.mark("response_cache_hit")
+            parts.append(cached)
+            yield cached
+            return
+        import ollama
+        stream = await ollama.AsyncClient().chat(model=model_name,
+                                                 stream=True, messages=message_history.messages(),
+                                                 keep_alive=config['OLLAMA_KEEP_ALIVE'],
+                                                 options=cpu_budget.ollama_options())
+        with tracer.span("llm_stream"):
+            async for chunk in stream:
+                if not parts:
+                    tracer.mark("llm_first_token")
+                parts.append(chunk['message']['content'])
+                yield parts[-1]
+        model_warmup.touch()
+        finished = True
 
-    else:
-        msg_history = message_history
+    try:
+        # off the event loop, the lookup may embed the question
+        cached = await asyncio.to_thread(response_cache.get, transcription, context)
+        if cached is None:
+            # loads the model first if it was evicted. Shielded, so if the turn is cancelled the load
+            # still finishes in its thread and is released below rather than holding the model forever
+            acquiring = asyncio.ensure_future(asyncio.to_thread(model_registry.acquire, 'llm'))
+            await asyncio.shield(acquiring)
+        response = await dictate_stream_async(text_chunks(), say=say)
+    finally:
+        if acquiring is not None:
+            release_when_acquired(acquiring, 'llm')
+        if parts:
+            message_history.append({
+                'role': 'assistant',
+                'content': "".join(parts),
+            })
+        else:
+            message_history.drop_latest()
 
-    stream = ollama.chat(model=model_name,
-                         stream=True, messages=msg_history)
+    # a reply cut short (too long to say, or the turn cancelled) isn't worth repeating
+    if cached is None and finished and not (cancelled is not None and cancelled.is_set()):
+        await asyncio.to_thread(response_cache.put, transcription, context, response)
+    return response, message_history
 
-    response = dictate_ollama_stream(stream)
 
-    message_history.append({
-        'role': 'assistant',
-        'content': response,
-    })
+def release_when_acquired(acquiring, name):
+    """
+    Release a model once the future acquiring it is done, now if it already is.
+    """
+    def release(future):
+        if not future.cancelled() and future.exception() is None:
+            model_registry.release(name)
 
-    return response, message_history
+    if acquiring.done():
+        release(acquiring)
+    else:
+        acquiring.add_done_callback(release)
 
 
-def add_in_weather_data(message_history, transcription):
+def response_context(model_name, intent=None, message_history=None):
     """
-    Add in weather data to the message history.
+    What a cached reply depends on besides the question: the model, the intent, the version of its RAG
+    data, and a digest of the system prompt and the conversation before the question, so "what is my
+    name?" is only answered from the cache after exactly the same conversation.
+    """
+    context = model_name
+    if intent is not None:
+        provider = providers.get(intent.name)
+        context += f"|{intent.name}|{provider.version if provider is not None else ''}"
+    if message_history is not None:
+        # the question itself is the last message, the cache keys on its normalized text
+        earlier = json.dumps(message_history.messages()[:-1], sort_keys=True)
+        context += "|" + hashlib.sha1(earlier.encode("utf-8")).hexdigest()[:16]
+    return context
+
+
+def trace_stream(stream, name="llm_stream", first="llm_first_token"):
+    with tracer.span(name):
+        for i, chunk in enumerate(stream):
+            if i == 0:
+                tracer.mark(first)
+            yield chunk
+
+
+class DataProvider:
+    """
+    One source of external data for RAG. Results are cached for `ttl` seconds in memory
+    (and on disk if `cache_dir` is set), so repeated questions don't wait on the network.
+    If a refresh fails, the last good result is served instead.
     """
 
+    def __init__(self, name, fetch, base_url, ttl=600, cache_dir=None, session=None, timeout=5):
+        self.name = name
+        self.fetch = fetch
+        self.base_url = base_url
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.data = None
+        self.fetched_at = 0.
+        self.last_requested = 0.
+        self._lock = threading.Lock()
+        self.load_from_disk()
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.cache_dir, f"{self.name}.json")
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    @property
+    def version(self):
+        """
+        Changes whenever new data is fetched.
+        """
+        return self.fetched_at
+
+    def get(self):
+        self.last_requested = time.time()
+        if self.data is not None and self.age < self.ttl:
+            return self.data
+        try:
+            with tracer.span("rag_fetch"):
+                return self.refresh(force=False)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            if self.data is None:
+                raise
+            print(f"Could not refresh {self.name}, using data from {self.age:.0f}s ago: {e}")
+            return self.data
+
+    def refresh(self, force=True):
+        with self._lock:
+            # a prefetch may have fetched while this was waiting for the lock
+            if not force and self.data is not None and self.age < self.ttl:
+                return self.data
+            data = self.fetch(self.session, self.base_url, self.timeout)
+            self.data = data
+            self.fetched_at = time.time()
+            self.save_to_disk()
+        return data
+
+    def load_from_disk(self):
+        if not self.cache_dir or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            data, fetched_at = cached['data'], cached['fetched_at']
+        except (OSError, ValueError, KeyError, TypeError):
+            # unreadable or from an older layout, fetched again when first needed
+            return
+        self.data = data
+        self.fetched_at = fetched_at
+
+    def save_to_disk(self):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.cache_path, "w") as f:
+            json.dump({'fetched_at': self.fetched_at, 'data': self.data}, f)
+
+
+class BackgroundRefresher:
+    """
+    Keeps recently used providers fresh, so a question can be answered from cache without waiting on the network.
+    """
+
+    def __init__(self, providers, interval=60, hot_seconds=24 * 60 * 60):
+        self.providers = providers
+        self.interval = interval
+        self.hot_seconds = hot_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for provider in list(self.providers.values()):
+                hot = time.time() - provider.last_requested < self.hot_seconds
+                if hot and provider.age > provider.ttl / 2:
+                    try:
+                        provider.refresh()
+                    except Exception as e:
+                        print(f"Background refresh of {provider.name} failed: {e}")
+
+
+def fetch_weather(session, base_url, timeout):
     api_key = os.getenv("TOMORROWIO_API_KEY")
     headers = {"accept": "application/json"}
+    rt_response = session.get(f"{base_url}v4/weather/realtime",
+                              params={"location": config["WEATHER_LOCATION"], "apikey": api_key},
+                              headers=headers, timeout=timeout)
+    rt_response.raise_for_status()
+
+    data = rt_response.json()['data']
+    return {
+        'location': rt_response.json()['location']['name'],
+        'temperature': data['values']['temperature'],
+        'humidity': data['values']['humidity'],
+        'precipitation': data['values']['precipitationProbability'],
+        'cloud_cover': data['values']['cloudCover'],
+    }
+
 
-    rt_url = f"https://api.tomorrow.io/v4/weather/realtime?location=new%20york&apikey={api_key}"
+def fetch_news(session, base_url, timeout):
+    from bs4 import BeautifulSoup
+    response = session.get(base_url, timeout=timeout)
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    news = soup.find_all('tr', class_='athing')
+    top_articles = ""
+    for n in news[:1]:
+        top_articles += n.text + "\n"
+    return top_articles
+
+
+http_session = requests.Session()
+providers = {}
+
+
+def register_provider(provider):
+    providers[provider.name] = provider
+    return provider
+
+
+register_provider(DataProvider('weather', fetch_weather,
+                               base_url=config['WEATHER_URL'],
+                               ttl=config['RAG_CACHE_TTL']['weather'],
+                               cache_dir=config['RAG_CACHE_DIR'],
+                               session=http_session,
+                               timeout=config['RAG_TIMEOUT']))
+register_provider(DataProvider('news', fetch_news,
+                               base_url=config['NEWS_URL'],
+                               ttl=config['RAG_CACHE_TTL']['news'],
+                               cache_dir=config['RAG_CACHE_DIR'],
+                               session=http_session,
+                               timeout=config['RAG_TIMEOUT']))
+
+
+def prefetch(intent):
+    """
+    Get ready for a likely intent while the user is still talking: reload the model if it has gone
+    idle, and fetch the intent's RAG data into its provider's cache.
+    """
+    rewarm_model()
+    provider = providers.get(intent.name)
+    if provider is not None:
+        threading.Thread(target=prefetch_provider, args=(provider,), daemon=True).start()
+
+
+def prefetch_provider(provider):
     try:
-        rt_response = requests.get(rt_url, headers=headers)
-    except:
+        provider.get()
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"Could not prefetch {provider.name}: {e}")
+
+
+def add_in_weather_data(message_history, transcription):
+    """
+    Add in weather data to the message history.
+    """
+    try:
+        weather = providers['weather'].get()
+    except (requests.RequestException, KeyError, ValueError):
         message_history.append({
             'role': 'user',
             'content': "Can you tell me wifi isn't working?",
@@ -95,23 +397,15 @@ def add_in_weather_data(message_history, transcription):
 
         return message_history
 
-    data = rt_response.json()['data']
-    temp = data['values']['temperature']
-    humidity = data['values']['humidity']
-    precipitation = data['values']['precipitationProbability']
-    cloudCover = data['values']['cloudCover']
-
-    location = rt_response.json()['location']['name']
-
     message_history.append({
         'role': 'user',
         'content': f"""Current weather data:
 
-        Location: {location}
-        T: {temp} C
-        Humidity: {humidity}%
-        Rain Prob: {precipitation}%
-        Cloud Cover: {cloudCover}%
+        Location: {weather['location']}
+        T: {weather['temperature']} C
+        Humidity: {weather['humidity']}%
+        Rain Prob: {weather['precipitation']}%
+        Cloud Cover: {weather['cloud_cover']}%
 
         Question:
         {transcription}
@@ -123,25 +417,15 @@ def add_in_weather_data(message_history, transcription):
 
 
 def add_in_news_data(message_history, transcription):
-
-    url = "https://news.ycombinator.com/"
     try:
-        response = requests.get(url)
-
-    except:
+        top_articles = providers['news'].get()
+    except (requests.RequestException, KeyError, ValueError):
         message_history.append({
             'role': 'user',
             'content': "Can you tell me wifi isn't working?",
         })
         return message_history
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    news = soup.find_all('tr', class_='athing')
-    top_articles = ""
-    for n in news[:1]:
-        top_articles += n.text + "\n"
-
     message_history.append({
         'role': 'user',
         'content': f"""Here are the top articles on HackerNews:
@@ -158,14 +442,17 @@ def add_in_news_data(message_history, transcription):
     return message_history
 
 
-def generate_image_response(message_history, transcription):
+def generate_image_response(message_history, transcription, cancelled=None):
     """
     Generate an image response.
+    This runs in a thread, so a barge-in stops it through `cancelled`, the turn's threading.Event:
+    nothing more is spoken and the history is left as it was.
     """
+    added = []
     if config["VISION_MODEL"] == 'detr':
-        caption = generate_bounding_box_caption(model, processor)
+        caption = generate_bounding_box_caption(cancelled=cancelled)
 
-        message_history.append({
+        added.append({
             'role': 'user',
             'content': f"""Here is a description of the objects detected by an AI model:
 
@@ -177,35 +464,35 @@ def generate_image_response(message_history, transcription):
             Answer:
             """,
         })
-        stream = ollama.chat(model=config["LOCAL_MODEL"],
-                             stream=True, messages=message_history)
+        import ollama
+        with model_registry.use('llm'):
+            stream = ollama.chat(model=config["LOCAL_MODEL"],
+                                 stream=True, messages=message_history.messages() + added,
+                                 keep_alive=config['OLLAMA_KEEP_ALIVE'],
+                                 options=cpu_budget.ollama_options())
 
-        response = dictate_ollama_stream(stream)
+            response = dictate_ollama_stream(trace_stream(stream), cancelled=cancelled)
+        model_warmup.touch()
 
     elif config["VISION_MODEL"] == 'moondream':
-        speak("Taking a picture.")
-
-        os.system("libcamera-still -o images/image.jpg")
-        speak("Analyzing the image.")
-
-        prompt = '"<image>\n\nQuestion: What do you see?\n\nAnswer: "'
-        response = ""
-        word = ""
-
-        for chunk in generate_gguf_stream(llama_cpp_path=config["LLAMA_CPP_PATH"],
-                                          model_path=config["MOONDREAM_MODEL_PATH"],
-                                          mmproj_path=config["MOONDREAM_MMPROJ_PATH"],
-                                          image_path="images/image.jpg",
-                                          prompt=prompt,
-                                          temp=0.):
-            word += chunk
-            if ' ' in chunk:
-                speak(word)
-                response += word
-                word = ""
-
-        speak(word)
+        speak("Taking a picture.", cancelled=cancelled)
 
+        with tracer.span("camera"):
+            image = camera.capture(max_size=(756, 756))
+        response, signature = vision_cache.get('moondream', image)
+        if response is not None:
+            dictate_stream([response], cancelled=cancelled)
+        else:
+            speak("Analyzing the image.", cancelled=cancelled)
+            response = dictate_stream(trace_stream(describe_image(image), "vision", "vision_first_token"),
+                                      cancelled=cancelled)
+            if cancelled is None or not cancelled.is_set():
+                vision_cache.put('moondream', signature, response)
+
+    if cancelled is not None and cancelled.is_set():
+        return response, message_history
+    for message in added:
+        message_history.append(message)
     message_history.append({
         'role': 'user',
         'content': transcription,
@@ -216,3 +503,44 @@ def generate_image_response(message_history, transcription):
     })
 
     return response, message_history
+
+
+intent_router.register('weather', add_in_weather_data, announcement="Getting weather data.")
+intent_router.register('news', add_in_news_data, announcement="Getting news data.")
+if config["VISION_MODEL"] is not None:
+    intent_router.register('vision', generate_image_response, announcement="Taking a picture.", responds=True)
+
+
+def describe_image(image, question="What do you see?"):
+    """
+    Stream moondream's description of an image, from the resident llama.cpp server if there is one,
+    otherwise by running llava-cli on a saved copy.
+    """
+    if llava_server is not None:
+        try:
+            # starts the server if the registry stopped it to free memory
+            model_registry.acquire('moondream')
+        except (OSError, RuntimeError, TimeoutError) as e:
+            print(f"llama.cpp server unavailable, falling back to llava-cli: {e}")
+        else:
+            try:
+                llava_server.ensure_running()
+            except (OSError, RuntimeError, TimeoutError) as e:
+                model_registry.release('moondream')
+                print(f"llama.cpp server unavailable, falling back to llava-cli: {e}")
+            else:
+                try:
+                    yield from llava_server.generate_stream(image, question, temp=0.)
+                finally:
+                    model_registry.release('moondream')
+                return
+
+    image.save("images/image.jpg")
+    yield from generate_gguf_stream(llama_cpp_path=config["LLAMA_CPP_PATH"],
+                                    model_path=config["MOONDREAM_MODEL_PATH"],
+                                    mmproj_path=config["MOONDREAM_MMPROJ_PATH"],
+                                    image_path="images/image.jpg",
+                                    prompt=f'"<image>\n\nQuestion: {question}\n\nAnswer: "',
+                                    temp=0.,
+                                    threads=cpu_budget.threads("vision"),
+                                    preexec_fn=cpu_budget.preexec("vision"))
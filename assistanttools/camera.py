@@ -0,0 +1,192 @@
+import glob
+import importlib.util
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+import numpy as np
+from config import config
+
+
+class CameraService:
+    """
+    Keeps the camera sensor open with picamera2 and holds the latest frames in a ring buffer.
+
+    Auto-exposure has already settled by the time a vision query comes in, and frames are handed
+    over as in-memory images, so a query costs detection time rather than camera start-up time.
+    """
+
+    def __init__(self, resolution=(1280, 960), buffer_size=4, frame_interval=0.5):
+        self.resolution = tuple(resolution)
+        self.frame_interval = frame_interval
+        self.frames = deque(maxlen=buffer_size)
+        self.new_frame = threading.Condition()
+        self.camera = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def open(self):
+        from picamera2 import Picamera2
+        self.camera = Picamera2()
+        # picamera2's BGR888 is laid out R, G, B in memory, which is what PIL expects
+        camera_config = self.camera.create_video_configuration(
+            main={"size": self.resolution, "format": "BGR888"})
+        self.camera.configure(camera_config)
+        self.camera.start()
+
+    def grab(self):
+        return self.camera.capture_array()
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera.close()
+            self.camera = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self.open()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                frame = self.grab()
+            except Exception as e:
+                print(f"Camera capture failed: {e}")
+                self._stopped.wait(1)
+                continue
+            with self.new_frame:
+                self.frames.append((time.time(), frame))
+                self.new_frame.notify_all()
+            self._stopped.wait(self.frame_interval)
+
+    def latest(self, max_age=None, timeout=5):
+        """
+        The newest frame as an RGB array. Waits for a new one if the newest is older than `max_age` seconds.
+        """
+        self.start()
+        deadline = time.time() + timeout
+        with self.new_frame:
+            while not self.frames or (max_age is not None and time.time() - self.frames[-1][0] > max_age):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if self.frames:
+                        break
+                    raise TimeoutError("No frame from the camera.")
+                self.new_frame.wait(remaining)
+            return self.frames[-1][1]
+
+    def capture(self, max_size=None, max_age=None):
+        """
+        The newest frame as a PIL image, shrunk to fit within `max_size` (width, height) if given.
+        """
+        from PIL import Image
+        image = Image.fromarray(self.latest(max_age=max_age))
+        if max_size is not None:
+            image.thumbnail(max_size)
+        return image
+
+
+class FileCamera(CameraService):
+    """
+    Stand-in camera for tests and benchmarks. Cycles through the images matching `path`
+    (a file or a glob) as if they were camera frames.
+    """
+
+    def __init__(self, path, frame_interval=0.5, **kwargs):
+        super().__init__(frame_interval=frame_interval, **kwargs)
+        self.path = path
+        self.paths = []
+        self.index = 0
+
+    def open(self):
+        self.paths = sorted(glob.glob(self.path))
+        if not self.paths:
+            raise FileNotFoundError(f"No images match {self.path}")
+
+    def grab(self):
+        from PIL import Image
+        image = Image.open(self.paths[self.index % len(self.paths)]).convert("RGB")
+        self.index += 1
+        return np.asarray(image)
+
+    def close(self):
+        pass
+
+
+class LibcameraStill(CameraService):
+    """
+    The old behaviour: run libcamera-still for every request. Used when picamera2 isn't installed.
+    """
+
+    def __init__(self, image_path="images/camera.jpg", **kwargs):
+        super().__init__(**kwargs)
+        self.image_path = image_path
+
+    def start(self):
+        return self
+
+    def latest(self, max_age=None, timeout=5):
+        from PIL import Image
+        os.makedirs(os.path.dirname(self.image_path) or ".", exist_ok=True)
+        subprocess.run(["libcamera-still", "-o", self.image_path], check=True)
+        return np.asarray(Image.open(self.image_path).convert("RGB"))
+
+
+def create_camera(backend=config["CAMERA_BACKEND"]):
+    if backend == "file":
+        return FileCamera(config["CAMERA_STUB_PATH"],
+                          frame_interval=config["CAMERA_FRAME_INTERVAL"])
+    if backend == "picamera2":
+        if importlib.util.find_spec("picamera2") is not None:
+            return CameraService(resolution=config["CAMERA_RESOLUTION"],
+                                 frame_interval=config["CAMERA_FRAME_INTERVAL"])
+        print("picamera2 is not installed, falling back to libcamera-still.")
+    return LibcameraStill()
+
+
+class LazyCamera:
+    """
+    The configured camera, created on first use, so importing this module doesn't probe for
+    picamera2 or open a device when vision is off.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.camera = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self.camera is None:
+                self.camera = create_camera(self.backend or config["CAMERA_BACKEND"])
+            return self.camera
+
+    def start(self):
+        return self.get().start()
+
+    def stop(self):
+        if self.camera is not None:
+            self.camera.stop()
+
+    def latest(self, max_age=None, timeout=5):
+        return self.get().latest(max_age=max_age, timeout=timeout)
+
+    def capture(self, max_size=None, max_age=None):
+        return self.get().capture(max_size=max_size, max_age=max_age)
+
+
+camera = LazyCamera()
@@ -0,0 +1,103 @@
+from collections import deque
+
+
+def count_tokens(text):
+    """
+    Rough token estimate (~4 characters per token). Good enough for budgeting without loading a tokenizer.
+    """
+    return len(text) // 4 + 1
+
+
+class ConversationContext:
+    """
+    Conversation history trimmed to a token budget.
+
+    The system prompt is always pinned first. Token counts are computed once when a message is added.
+    When the budget is exceeded, the oldest turns are dropped in one go, down to `low_water` of the
+    budget, so the messages sent to Ollama keep the same prefix for several turns in a row and its
+    KV cache can be reused instead of re-evaluating the whole prompt every time.
+
+    It behaves like the list of messages it replaces: `append`, indexing, `len` and iteration work.
+    """
+
+    def __init__(self, system_prompt, token_budget=1024, max_messages=32, low_water=0.75):
+        self.system = {
+            'role': 'user',
+            'content': system_prompt,
+        }
+        self.system_tokens = count_tokens(system_prompt)
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.low_water = low_water
+        self.turns = deque()
+        self.turn_tokens = deque()
+        self.total_tokens = self.system_tokens
+        self.appended = 0
+        self._messages = None
+
+    def append(self, message):
+        tokens = count_tokens(message['content'])
+        self.appended += 1
+        self.turns.append(message)
+        self.turn_tokens.append(tokens)
+        self.total_tokens += tokens
+        if self._messages is not None:
+            self._messages.append(message)
+        if self.total_tokens > self.token_budget or len(self.turns) > self.max_messages:
+            self.trim()
+
+    def trim(self):
+        """
+        Drop the oldest turns until under `low_water` of both budgets. The latest message is always kept.
+        """
+        token_target = self.token_budget * self.low_water
+        message_target = int(self.max_messages * self.low_water)
+        while len(self.turns) > 1 and (self.total_tokens > token_target or len(self.turns) > message_target):
+            self.drop_oldest()
+        # don't leave an answer whose question has been dropped
+        while len(self.turns) > 1 and self.turns[0]['role'] == 'assistant':
+            self.drop_oldest()
+        self._messages = None
+
+    def drop_oldest(self):
+        self.turns.popleft()
+        self.total_tokens -= self.turn_tokens.popleft()
+
+    def drop_latest(self):
+        """
+        Take back the last message, e.g. a question whose answer was cancelled before any of it was generated.
+        """
+        self.turns.pop()
+        self.total_tokens -= self.turn_tokens.pop()
+        self.appended -= 1
+        self._messages = None
+
+    def messages(self):
+        """
+        The messages to send to the model, system prompt first.
+        """
+        if self._messages is None:
+            self._messages = [self.system, *self.turns]
+        return self._messages
+
+    def since(self, appended):
+        """
+        The messages added after `appended` was read, as far as they are still in the history.
+        """
+        count = min(self.appended - appended, len(self.turns))
+        return list(self.turns)[len(self.turns) - count:]
+
+    def reset(self):
+        self.turns.clear()
+        self.turn_tokens.clear()
+        self.total_tokens = self.system_tokens
+        self._messages = None
+
+    def __getitem__(self, index):
+        return self.messages()[index]
+
+    def __len__(self):
+        return len(self.turns) + 1
+
+    def __iter__(self):
+        return iter(self.messages())
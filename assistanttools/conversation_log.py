@@ -0,0 +1,157 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from assistanttools.context import ConversationContext
+from config import config
+
+
+class ConversationLog:
+    """
+    Append-only JSONL log of conversation turns, one record per turn.
+
+    `log_turn` only puts the record on a queue. A background thread writes queued records in
+    batches, every `flush_interval` seconds or once `batch_size` are waiting, so nothing on the
+    conversation's hot path touches the disk. The file rotates at `max_bytes`, and rotated files
+    are gzipped if `compress` is set.
+    """
+
+    def __init__(self, path="storage/conversations.jsonl", flush_interval=2.0, batch_size=32,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, compress=True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def log_turn(self, conversation_id, turn, messages, **metadata):
+        """
+        Queue a turn: the messages it added to the history, plus anything else worth keeping
+        (intent, latency, trace id).
+        """
+        self.start()
+        self.queue.put({
+            'conversation': conversation_id,
+            'turn': turn,
+            'time': time.time(),
+            'messages': list(messages),
+            **metadata,
+        })
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        return self
+
+    def flush(self, timeout=5):
+        """
+        Block until everything queued has been written, or `timeout` seconds have passed.
+        """
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0., deadline - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except OSError as e:
+                print(f"Could not write the conversation log: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, records):
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(lines) > self.max_bytes:
+            self.rotate()
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    def backup_path(self, i):
+        return f"{self.path}.{i}.gz" if self.compress else f"{self.path}.{i}"
+
+    def rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self.backup_path(i)):
+                os.replace(self.backup_path(i), self.backup_path(i + 1))
+        if self.compress:
+            with open(self.path, "rb") as src, gzip.open(self.backup_path(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.backup_path(1))
+
+
+def read_log(path="storage/conversations.jsonl", backup_count=5):
+    """
+    Yield every logged turn, oldest first, including rotated and compressed files.
+    """
+    paths = []
+    for i in range(backup_count, 0, -1):
+        paths += [f"{path}.{i}.gz", f"{path}.{i}"]
+    for p in paths + [path]:
+        if not os.path.exists(p):
+            continue
+        opener = gzip.open if p.endswith(".gz") else open
+        with opener(p, "rt") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def load_history(conversation_id, path="storage/conversations.jsonl", backup_count=5,
+                 system_prompt=config['SYSTEM_PROMPT'], **kwargs):
+    """
+    Rebuild a conversation's message history from the log, e.g. to resume it or analyze it.
+    """
+    history = ConversationContext(system_prompt, **kwargs)
+    for record in read_log(path, backup_count):
+        if record['conversation'] == conversation_id:
+            for message in record['messages']:
+                history.append(message)
+    return history
+
+
+conversation_log = ConversationLog(path=config['CONVERSATION_LOG_PATH'],
+                                   flush_interval=config['CONVERSATION_LOG_FLUSH_SECONDS'],
+                                   max_bytes=config['CONVERSATION_LOG_MAX_MB'] * 1024 * 1024,
+                                   backup_count=config['CONVERSATION_LOG_BACKUPS'],
+                                   compress=config['CONVERSATION_LOG_COMPRESS'])
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.conversation_log [conversation_id]
+    if len(sys.argv) > 1:
+        history = load_history(sys.argv[1], config['CONVERSATION_LOG_PATH'], config['CONVERSATION_LOG_BACKUPS'],
+                               token_budget=float('inf'), max_messages=float('inf'))
+        print(json.dumps(history.messages(), indent=4))
+    else:
+        turns = {}
+        for record in read_log(config['CONVERSATION_LOG_PATH'], config['CONVERSATION_LOG_BACKUPS']):
+            turns.setdefault(record['conversation'], []).append(record['time'])
+        for conversation_id, times in turns.items():
+            print(f"{conversation_id}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(times[0]))}  {len(times)} turns")
@@ -0,0 +1,103 @@
+import os
+from config import config
+
+STAGES = ("asr", "llm", "vision")
+
+
+class CpuBudget:
+    """
+    How many threads, and optionally which cores, each stage of the pipeline may use.
+
+    whisper, Ollama, torch and llava-cli all default to a thread per core, so when two of them
+    overlap (the model re-warming while a command is transcribed, DETR while an announcement is
+    spoken) they oversubscribe the Pi's four cores and all of them slow down.
+
+    `threads` maps a stage ("asr", "llm", "vision") to a thread count and `affinity` maps a stage to
+    the cores its processes (whisper.cpp, llama.cpp) start on, None leaves the backend's default.
+    Ollama runs as its own service, so its cores are set there (systemd's CPUAffinity) rather than
+    here. `phases` override thread counts while the pipeline is in that phase ("listening" while a
+    command is captured and transcribed, "responding" while the reply is generated). Only settings
+    that can change per call follow the phase: the whisper.cpp and llava-cli commands and torch's
+    thread count. Models and servers loaded once take the base budget, and so does Ollama, because
+    a different num_thread makes it reload the model.
+    """
+
+    def __init__(self, threads=None, affinity=None, phases=None, cpu_count=None):
+        self.base_threads = dict(threads or {})
+        self.affinity_cores = dict(affinity or {})
+        self.phases = dict(phases or {})
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self.phase = None
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def threads(self, stage, base=False, phase=None):
+        """
+        Thread count for `stage` in `phase` (by default the current one, ignored if `base`), None for the default.
+        """
+        threads = self.base_threads.get(stage)
+        if not base:
+            threads = self.phases.get(phase or self.phase, {}).get(stage, threads)
+        if threads is None:
+            return None
+        return max(1, min(int(threads), self.cpu_count))
+
+    def affinity(self, stage):
+        """
+        The cores `stage` is pinned to, as far as this machine has them, or None.
+        """
+        cores = self.affinity_cores.get(stage)
+        if not cores or not hasattr(os, "sched_setaffinity"):
+            return None
+        cores = {core for core in cores if core < self.cpu_count}
+        return cores or None
+
+    def preexec(self, stage):
+        """
+        A preexec_fn for subprocess.Popen that pins the child to the stage's cores, or None.
+        """
+        cores = self.affinity(stage)
+        if cores is None:
+            return None
+        return lambda: os.sched_setaffinity(0, cores)
+
+    def ollama_options(self):
+        """
+        Options for every Ollama request. They must be the same on every call or Ollama reloads the model.
+        """
+        threads = self.threads("llm", base=True)
+        return {} if threads is None else {'num_thread': threads}
+
+    def torch_threads(self):
+        """
+        Set torch's intra-op threads for the vision stage, before each inference.
+        """
+        threads = self.threads("vision")
+        if threads is not None:
+            import torch
+            if torch.get_num_threads() != threads:
+                torch.set_num_threads(threads)
+
+    def describe(self):
+        rows = []
+        for stage in STAGES:
+            counts = [self.threads(stage, base=True)] + [self.threads(stage, phase=phase) for phase in self.phases]
+            counts = ["all" if threads is None else str(threads) for threads in counts]
+            cores = self.affinity(stage)
+            rows.append((stage, counts, "any" if cores is None else ",".join(map(str, sorted(cores)))))
+        return ["default"] + list(self.phases), rows
+
+
+cpu_budget = CpuBudget(threads=config['CPU_THREADS'],
+                       affinity=config['CPU_AFFINITY'],
+                       phases=config['CPU_PHASE_THREADS'])
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.cpu_budget
+    phases, rows = cpu_budget.describe()
+    print(f"{cpu_budget.cpu_count} cores")
+    print(f"{'stage':<10}" + "".join(f"{phase:>12}" for phase in phases) + f"{'cores':>12}")
+    for stage, counts, cores in rows:
+        print(f"{stage:<10}" + "".join(f"{count:>12}" for count in counts) + f"{cores:>12}")
@@ -1,40 +1,137 @@
-from transformers import DetrImageProcessor, DetrForObjectDetection
-from PIL import Image
-import os
-from torch import tensor
+import threading
+import time
+from assistanttools.camera import camera
+from assistanttools.cpu_budget import cpu_budget
+from assistanttools.model_registry import current_rss_mb, model_registry
+from assistanttools.tracing import tracer
 from assistanttools.utils import speak
+from assistanttools.vision_cache import vision_cache
 from config import config
 
-if config["VISION_MODEL"] == 'detr':
 
-    processor = DetrImageProcessor.from_pretrained(
-        "facebook/detr-resnet-50", revision="no_timm")
-    model = DetrForObjectDetection.from_pretrained(
-        "facebook/detr-resnet-50", revision="no_timm")
+class DetrWorker:
+    """
+    Resident DETR object detector.
 
-else:
-    processor = None
-    model = None
+    transformers and torch are only imported when the model is first needed (or warmed in a
+    background thread), so the text-only path never pays for them. Inference runs under
+    torch.inference_mode, optionally with dynamic int8 quantization of the linear layers, and
+    images are downscaled to the processor's target size before preprocessing.
+    """
 
+    def __init__(self, model_id="facebook/detr-resnet-50", revision="no_timm",
+                 quantize=False, threads=None, threshold=0.9):
+        self.model_id = model_id
+        self.revision = revision
+        self.quantize = quantize
+        self.threads = threads
+        self.threshold = threshold
+        self.model = None
+        self.processor = None
+        self.target_sizes = {}
+        self._lock = threading.Lock()
 
-def generate_bounding_box_caption(model, processor):
-    speak("Taking a picture.")
-    os.system("libcamera-still -o images/detr-image.jpg")
-    speak("Analyzing the image.")
-    image = Image.open("images/detr-image.jpg")
+    def load(self):
+        with self._lock:
+            if self.model is not None:
+                return
+            start = time.time()
+            import torch
+            from transformers import DetrImageProcessor, DetrForObjectDetection
 
-    inputs = processor(images=image, return_tensors="pt")
-    outputs = model(**inputs)
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            processor = DetrImageProcessor.from_pretrained(
+                self.model_id, revision=self.revision)
+            model = DetrForObjectDetection.from_pretrained(
+                self.model_id, revision=self.revision)
+            model.eval()
+            if self.quantize:
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.processor = processor
+            self.model = model
+            print(f"DETR loaded in {time.time() - start:.1f}s, {current_rss_mb():.0f} MB resident.")
 
-    target_sizes = tensor([image.size[::-1]])
+    def warm(self, background=True):
+        if background:
+            threading.Thread(target=self.load, daemon=True).start()
+        else:
+            self.load()
 
-    results = processor.post_process_object_detection(
-        outputs, target_sizes=target_sizes, threshold=0.9)[0]
+    def unload(self):
+        with self._lock:
+            self.model = None
+            self.processor = None
+            self.target_sizes = {}
+
+    def downscale(self, image):
+        """
+        Shrink the image to the size the processor would resize it to anyway, so preprocessing
+        doesn't have to work on a full resolution camera frame.
+        """
+        from PIL import Image
+        shortest_edge = self.processor.size.get("shortest_edge", 800)
+        scale = shortest_edge / min(image.size)
+        if scale >= 1:
+            return image
+        return image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+
+    def target_size(self, size):
+        # reuse the same tensor for every frame of the same resolution
+        if size not in self.target_sizes:
+            import torch
+            self.target_sizes[size] = torch.tensor([size[::-1]])
+        return self.target_sizes[size]
+
+    def detect(self, image):
+        """
+        Return [(label, score, box)] for objects above the threshold, with boxes in the original image's coordinates.
+        """
+        import torch
+        self.load()
+        start = time.time()
+        original_size = image.size
+        image = self.downscale(image.convert("RGB"))
+
+        cpu_budget.torch_threads()
+        with torch.inference_mode():
+            inputs = self.processor(images=image, return_tensors="pt")
+            outputs = self.model(**inputs)
+            results = self.processor.post_process_object_detection(
+                outputs, target_sizes=self.target_size(original_size), threshold=self.threshold)[0]
+
+        detections = []
+        for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
+            detections.append((self.model.config.id2label[label.item()],
+                               round(score.item(), 3),
+                               [round(i, 2) for i in box.tolist()]))
+        print(f"DETR took {time.time() - start:.2f}s, {current_rss_mb():.0f} MB resident.")
+        return detections
+
+
+detr_worker = DetrWorker(quantize=config["DETR_QUANTIZE"],
+                         threads=cpu_budget.threads("vision", base=True))
+# loaded when a picture is first taken and unloaded if the memory is needed for another model
+model_registry.register('detr', load=lambda: detr_worker.load(), unload=lambda: detr_worker.unload(),
+                        size_mb=config['MODEL_SIZE_MB']['detr'])
+
+
+def generate_bounding_box_caption(worker=detr_worker, camera=camera, cancelled=None):
+    speak("Taking a picture.", cancelled=cancelled)
+    with tracer.span("camera"):
+        image = camera.capture()
+    cached, signature = vision_cache.get('detr', image)
+    if cached is not None:
+        return cached
+    speak("Analyzing the image.", cancelled=cancelled)
 
     detected_objects_str = "Here's what I saw, and with what pct confidence:\n"
 
-    for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-        box = [round(i, 2) for i in box.tolist()]
-        detected_objects_str += f"- {model.config.id2label[label.item()]} with confidence {round(score.item(), 3)}\n"
+    with tracer.span("vision"), model_registry.use('detr'):
+        detections = worker.detect(image)
+    for label, score, box in detections:
+        detected_objects_str += f"- {label} with confidence {score}\n"
 
+    vision_cache.put('detr', signature, detected_objects_str)
     return detected_objects_str
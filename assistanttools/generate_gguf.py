@@ -1,5 +1,10 @@
+import base64
+import codecs
+import io
+import json
 import subprocess
 import os
+from assistanttools.server_process import ManagedServer
 
 
 def generate_gguf(llama_cpp_path, model_path, mmproj_path, image_path, prompt, temp):
@@ -11,14 +16,62 @@ def generate_gguf(llama_cpp_path, model_path, mmproj_path, image_path, prompt, t
     return output
 
 
-def generate_gguf_stream(llama_cpp_path, model_path, mmproj_path, image_path, prompt, temp):
+def generate_gguf_stream(llama_cpp_path, model_path, mmproj_path, image_path, prompt, temp,
+                         threads=None, preexec_fn=None):
     command = f"./{llama_cpp_path}llava-cli -m {model_path} --mmproj {mmproj_path} --image {image_path} --temp {temp} -p {prompt}"
+    if threads:
+        command += f" -t {threads}"
     print("Command: ", command)
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, preexec_fn=preexec_fn)
+
+    # yield output as it appears, decoding incrementally so multi-byte characters split across reads survive
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for data in iter(lambda: process.stdout.read1(4096), b''):
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+class LlavaServer(ManagedServer):
+    """
+    Resident llama.cpp server with the moondream text model and mmproj loaded once.
+    Images are sent in memory as base64 JPEG and the answer is streamed back.
+    """
+
+    image_id = 10
+
+    def __init__(self, llama_cpp_path, model_path, mmproj_path, host="127.0.0.1", port=8911, threads=None,
+                 preexec_fn=None):
+        command = [f"./{llama_cpp_path}server", "-m", model_path, "--mmproj", mmproj_path,
+                   "--host", host, "--port", str(port)]
+        if threads:
+            command += ["-t", str(threads)]
+        super().__init__(command, host=host, port=port, health_path="/health", name="llama.cpp server",
+                         preexec_fn=preexec_fn)
 
-    # yield each output line as it appears
-    for byte in iter(lambda: process.stdout.read(1), b''):
-        yield byte.decode("utf-8")
+    def generate_stream(self, image, question, temp=0., n_predict=256):
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=90)
+        payload = {
+            "prompt": f"[img-{self.image_id}]\n\nQuestion: {question}\n\nAnswer: ",
+            "image_data": [{"data": base64.b64encode(buffer.getvalue()).decode("ascii"), "id": self.image_id}],
+            "temperature": temp,
+            "n_predict": n_predict,
+            "stream": True,
+        }
+        response = self.post("/completion", json=payload, stream=True, timeout=300)
+        # server-sent events, one JSON object per "data: " line
+        for line in response.iter_lines(decode_unicode=False):
+            if not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[len(b"data: "):])
+            if event.get("content"):
+                yield event["content"]
+            if event.get("stop"):
+                return
 
 
 if __name__ == '__main__':
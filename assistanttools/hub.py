@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+import numpy as np
+from config import config
+from assistanttools.actions import get_llm_response_async, rewarm_model
+from assistanttools.context import ConversationContext
+from assistanttools.conversation_log import conversation_log
+from assistanttools.intents import intent_router
+from assistanttools.satellite_protocol import (AUDIO, DONE, END, HELLO, RESET, SPEECH, TEXT, AudioCodec,
+                                               encode_speech, read_message, send_json, send_message)
+from assistanttools.tracing import tracer
+from assistanttools.utils import check_if_ignore, tts_engine
+from assistanttools.wake_word import contains_wake_word, strip_wake_word
+
+
+class Utterance:
+    def __init__(self, audio, ended):
+        self.audio = audio
+        self.ended = ended
+
+
+class FairScheduler:
+    """
+    Shares a fixed number of workers between sessions, round robin.
+
+    A session is in the ready queue at most once and only while it has no utterance in flight,
+    so a chatty satellite can't run two turns at once or get ahead of the others: after each turn
+    it goes to the back of the queue if it still has work waiting.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.ready = asyncio.Queue()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        return self
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def submit(self, session, utterance):
+        if len(session.pending) == session.pending.maxlen:
+            print(f"{session.satellite_id} is too far behind, dropping its oldest utterance.")
+        session.pending.append(utterance)
+        if not session.scheduled:
+            session.scheduled = True
+            self.ready.put_nowait(session)
+
+    async def _run(self):
+        while True:
+            session = await self.ready.get()
+            if session.closed or not session.pending:
+                # the satellite hung up, or its queue was dropped, since it was scheduled
+                session.scheduled = False
+                continue
+            try:
+                await session.run(session.pending.popleft())
+            except Exception as e:
+                print(f"{session.satellite_id} turn failed: {e}")
+            if session.pending and not session.closed:
+                self.ready.put_nowait(session)
+            else:
+                session.scheduled = False
+
+
+class HubSession:
+    """
+    One connected satellite: its own conversation id, history and queue of utterances.
+
+    Satellites only gate on voice activity, so the wake word is checked here. Until it is heard
+    (and again after `conversation_timeout` seconds without a command) utterances are ignored.
+    """
+
+    def __init__(self, hub, satellite_id, writer, codec="adpcm"):
+        self.hub = hub
+        self.satellite_id = satellite_id
+        self.writer = writer
+        self.codec = codec
+        self.decoder = AudioCodec(codec)
+        self.conversation_id = str(uuid.uuid4())
+        # whisper.cpp's CLI fallback transcribes from a file, one per session so concurrent workers don't share it
+        self.wav_path = os.path.join(tempfile.gettempdir(), f"pi-card-{self.conversation_id}.wav")
+        self.message_history = ConversationContext(config['SYSTEM_PROMPT'],
+                                                   token_budget=config['CONTEXT_TOKEN_BUDGET'],
+                                                   max_messages=config['MAX_HISTORY_MESSAGES'])
+        self.pending = deque(maxlen=hub.queue_size)
+        self.scheduled = False
+        self.closed = False
+        self.in_conversation = False
+        self.last_command = 0.
+        self.turn_count = 0
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+
+    async def run(self, utterance):
+        tracer.start_turn(conversation_id=self.conversation_id, satellite=self.satellite_id)
+        tracer.record("queued", time.perf_counter() - utterance.ended)
+        try:
+            await self.handle_utterance(utterance.audio)
+        finally:
+            tracer.end_turn()
+            if not self.closed:
+                await send_message(self.writer, DONE)
+
+    async def handle_utterance(self, audio):
+        try:
+            transcription = await asyncio.to_thread(self.hub.transcribe, audio, self.wav_path)
+        finally:
+            if os.path.exists(self.wav_path):
+                os.remove(self.wav_path)
+        await send_json(self.writer, TEXT, {'text': transcription})
+        if time.monotonic() - self.last_command > self.hub.conversation_timeout:
+            self.in_conversation = False
+
+        if not self.in_conversation:
+            if not contains_wake_word(transcription, config['WAKE_WORD']):
+                return
+            rewarm_model()
+            self.in_conversation = True
+            self.last_command = time.monotonic()
+            transcription = strip_wake_word(transcription, config['WAKE_WORD'])
+            if check_if_ignore(transcription):
+                await self.say("Yes?", True)
+                return
+
+        started = time.perf_counter()
+        appended = self.message_history.appended
+        with tracer.span("intent_routing"):
+            intent = intent_router.route(transcription)
+        if intent.name == 'ignore':
+            return
+        self.last_command = time.monotonic()
+
+        if intent.name == 'exit':
+            await self.say("Program stopped. See you later!", True)
+            self.log_turn(transcription, intent, appended, started)
+            self.message_history.reset()
+            self.in_conversation = False
+            return
+
+        if intent.name == 'vision':
+            # the camera is on the hub, not in front of whoever asked
+            await self.say("I can't see from here.", True)
+        else:
+            _, self.message_history = await get_llm_response_async(
+                transcription, self.message_history, model_name=self.hub.model_name,
+                intent=intent, say=self.say)
+        self.log_turn(transcription, intent, appended, started)
+
+    async def say(self, text, cache=False):
+        """
+        Render a sentence here and send it to the satellite to play.
+        """
+        if not text.strip() or self.closed:
+            return
+        pcm, rate = await asyncio.to_thread(self.hub.tts.render, text, cache)
+        tracer.mark("tts_first_audio")
+        await send_message(self.writer, SPEECH, encode_speech(pcm, rate, self.codec))
+
+    def log_turn(self, transcription, intent, appended, started):
+        if not self.hub.store_conversations:
+            return
+        self.turn_count += 1
+        turn = tracer.current.get()
+        conversation_log.log_turn(self.conversation_id, self.turn_count,
+                                  self.message_history.since(appended),
+                                  transcription=transcription,
+                                  intent=intent.name,
+                                  satellite=self.satellite_id,
+                                  latency={'response': round(time.perf_counter() - started, 3)},
+                                  trace=turn.id if turn is not None else None)
+
+
+class Hub:
+    """
+    Runs transcription, the LLM and TTS for any number of satellites (see assistanttools/satellite.py).
+
+    Each connection is a HubSession. Finished utterances are queued per session and picked up by
+    `workers` FairScheduler workers, so one busy satellite can't starve the rest.
+    """
+
+    def __init__(self, transcribe, host="0.0.0.0", port=8920, workers=1, queue_size=4,
+                 conversation_timeout=60, model_name=config['LOCAL_MODEL'], tts=None,
+                 store_conversations=config['STORE_CONVERSATIONS']):
+        self.transcribe = transcribe
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.conversation_timeout = conversation_timeout
+        self.model_name = model_name
+        self.tts = tts or tts_engine
+        self.store_conversations = store_conversations
+        self.scheduler = FairScheduler(workers)
+        self.sessions = {}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.scheduler.start()
+        print(f"Hub listening on {self.host}:{self.port}")
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.scheduler.stop()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            kind, payload = await read_message(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if kind != HELLO:
+            writer.close()
+            return
+        try:
+            hello = json.loads(payload)
+            if not isinstance(hello, dict):
+                raise ValueError("not a JSON object")
+            satellite_id = str(hello.get('id') or "{}:{}".format(*writer.get_extra_info('peername')[:2]))
+            session = HubSession(self, satellite_id, writer, hello.get('codec', 'adpcm'))
+        except ValueError as e:
+            # a malformed HELLO or an unknown codec
+            print(f"Rejected a satellite: {e}")
+            writer.close()
+            return
+        self.sessions[satellite_id] = session
+        print(f"Satellite {satellite_id} connected.")
+
+        chunks = []
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == AUDIO:
+                    chunks.append(session.decoder.decode(payload))
+                elif kind == RESET:
+                    chunks = []
+                    session.decoder.reset()
+                elif kind == END and not chunks:
+                    await send_message(writer, DONE)
+                elif kind == END:
+                    self.scheduler.submit(session, Utterance(np.concatenate(chunks), time.perf_counter()))
+                    chunks = []
+                    session.decoder.reset()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            # audio that doesn't decode, e.g. an odd number of bytes of 16-bit PCM
+            print(f"Satellite {satellite_id} sent a malformed message: {e}")
+        finally:
+            session.close()
+            if self.sessions.get(satellite_id) is session:
+                del self.sessions[satellite_id]
+            writer.close()
+            print(f"Satellite {satellite_id} disconnected.")
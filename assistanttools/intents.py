@@ -0,0 +1,113 @@
+import re
+from typing import Callable, NamedTuple, Optional
+
+
+class Intent(NamedTuple):
+    name: str
+    confidence: float
+    keyword: str = ""
+
+
+class IntentHandler(NamedTuple):
+    function: Callable
+    announcement: Optional[str] = None
+    # True if the handler produces the reply itself (e.g. vision), False if it only adds context for the LLM.
+    # Handlers that reply are called with cancelled=, the turn's threading.Event, as they run in a thread
+    responds: bool = False
+
+
+CHAT = Intent('chat', 1.0)
+IGNORE = Intent('ignore', 1.0)
+
+# intent -> keyword -> confidence. Earlier intents win when several match.
+KEYWORDS = {
+    'exit': {"stop": 1.0, "exit": 1.0, "quit": 1.0, "goodbye": 0.9, "that's all": 0.8},
+    'weather': {"weather": 1.0, "forecast": 0.9},
+    'vision': {"photo": 1.0, "picture": 1.0, "image": 0.9, "what do you see": 1.0, "snap": 0.8, "shoot": 0.8},
+    'news': {"news": 1.0, "headlines": 0.9},
+}
+
+# these only count as commands in short utterances, "I'll stop by later" or "oh shoot" inside a question are chat
+COMMAND_ONLY = {"stop", "exit", "quit", "goodbye", "that's all", "snap", "shoot"}
+COMMAND_WORDS = 4
+
+
+def compile_matcher(keywords):
+    """
+    One regex for every keyword, with a named group per intent so a single pass finds them all.
+    Keywords also match with a trailing "s", so "pictures" and "photos" count.
+    """
+    groups = []
+    for name, words in keywords.items():
+        alternatives = "|".join(re.escape(x) for x in sorted(words, key=len, reverse=True))
+        groups.append(f"(?P<{name}>\\b(?:{alternatives})s?\\b)")
+    return re.compile("|".join(groups), re.IGNORECASE)
+
+
+class IntentRouter:
+    """
+    Maps a transcription to an intent with a confidence, then dispatches it through a registry of handlers.
+
+    Matching is a single precompiled word-boundary regex, so "stopwatch" or "newsletter" don't trigger
+    anything. An optional `classifier` (a function from text to Intent) is consulted when no keyword
+    matches confidently.
+    """
+
+    def __init__(self, keywords=KEYWORDS, min_confidence=0.5, classifier=None):
+        self.keywords = keywords
+        self.priority = list(keywords)
+        self.matcher = compile_matcher(keywords)
+        self.min_confidence = min_confidence
+        self.classifier = classifier
+        self.handlers = {}
+
+    def register(self, name, function, announcement=None, responds=False):
+        self.handlers[name] = IntentHandler(function, announcement, responds)
+        return function
+
+    def handler(self, intent):
+        return self.handlers.get(intent.name)
+
+    def route(self, transcription):
+        text = transcription.strip()
+        if is_noise(text):
+            return IGNORE
+
+        best = None
+        for match in self.matcher.finditer(text):
+            name = match.lastgroup
+            keyword = match.group(name).lower()
+            if keyword not in self.keywords[name]:
+                keyword = keyword[:-1]
+            confidence = self.keywords[name][keyword]
+            if keyword in COMMAND_ONLY and len(text.split()) > COMMAND_WORDS:
+                confidence *= 0.3
+            candidate = Intent(name, confidence, keyword)
+            if best is None or self.ranks_higher(candidate, best):
+                best = candidate
+
+        if best is not None and best.confidence >= self.min_confidence:
+            return best
+        if self.classifier is not None:
+            intent = self.classifier(text)
+            if intent is not None and intent.confidence >= self.min_confidence:
+                return intent
+        return CHAT
+
+    def ranks_higher(self, candidate, best):
+        if (candidate.confidence >= self.min_confidence) != (best.confidence >= self.min_confidence):
+            return candidate.confidence >= self.min_confidence
+        return self.priority.index(candidate.name) < self.priority.index(best.name)
+
+
+NOISE = re.compile(r"^(?:you|\.|)$|^\(.*\)", re.IGNORECASE)
+
+
+def is_noise(text):
+    """
+    Whisper's output for silence or fan noise: "you", ".", "" or a sound effect in parentheses.
+    """
+    return NOISE.match(text) is not None
+
+
+intent_router = IntentRouter()
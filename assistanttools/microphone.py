@@ -0,0 +1,163 @@
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+import speech_recognition as sr
+from assistanttools.utils import SAMPLE_RATE, iter_microphone_frames
+from assistanttools.vad import EnergyVad, Endpointer
+
+
+class MicrophoneStream:
+    """
+    Opens the microphone once and feeds 16 kHz float32 frames to consumers from a background thread.
+
+    Frames go through a bounded queue. If nobody is reading, the oldest frames are dropped,
+    so a consumer always picks up close to real time. The wake word and command listeners read
+    from the same stream, so handing off between them never reopens the device or loses audio.
+
+    Phrases are cut out by an Endpointer around `vad` (see assistanttools/vad.py), or around a
+    plain energy threshold if no VAD is given.
+    """
+
+    def __init__(self, device_index=None, queue_seconds=10, sample_rate=SAMPLE_RATE,
+                 vad=None, min_speech_seconds=0.2):
+        self.device_index = device_index
+        self.sample_rate = sample_rate
+        self.queue_seconds = queue_seconds
+        self.vad = vad
+        self.min_speech_seconds = min_speech_seconds
+        self.dropped_segments = 0
+        self.frames = None
+        self.source = None
+        self.error = None
+        self.last_capture_seconds = 0.
+        self.last_resample_seconds = 0.
+        self.resample_seconds = 0.
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.source = sr.Microphone(device_index=self.device_index)
+        self.source.__enter__()
+        frame_seconds = self.source.CHUNK / self.source.SAMPLE_RATE
+        self.frames = queue.Queue(
+            maxsize=max(1, int(self.queue_seconds / frame_seconds)))
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._capture, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        if self.source is not None:
+            self.source.__exit__(None, None, None)
+            self.source = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _capture(self):
+        try:
+            for frame, seconds in iter_microphone_frames(self.source, self.sample_rate):
+                if self._stopped.is_set():
+                    return
+                self.resample_seconds += seconds
+                self._put(frame)
+        except Exception as e:
+            self.error = e
+            self._put(None)
+
+    def _put(self, frame):
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def read(self, timeout=None):
+        """
+        Return the next frame, or None if no frame arrived within the timeout.
+        """
+        try:
+            frame = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if frame is None:
+            raise RuntimeError(f"Microphone capture stopped: {self.error}")
+        return frame
+
+    async def aread(self, timeout=None):
+        return await asyncio.to_thread(self.read, timeout)
+
+    def __iter__(self):
+        while True:
+            frame = self.read(timeout=1)
+            if frame is not None:
+                yield frame
+
+    def clear(self):
+        """
+        Throw away queued audio, e.g. the assistant's own voice captured while it was speaking.
+        """
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                return
+
+    def listen(self, timeout, phrase_time_limit, energy_threshold=0.01,
+               silence_seconds=0.8, pre_roll_seconds=0.3, initial_frames=None, stream=None):
+        """
+        Capture one phrase from the shared stream. Waits up to `timeout` seconds for speech to start,
+        then records until `silence_seconds` without speech or `phrase_time_limit` seconds.
+        Leading and trailing silence is trimmed, and bursts of noise too short to be speech are
+        skipped rather than returned.
+        `initial_frames` are speech another consumer already read (e.g. a barge-in), and start the phrase.
+        `stream` receives the phrase's audio while it is captured, see StreamingTranscriber.
+        Returns a float32 buffer, or None if nobody spoke.
+        """
+        endpointer = Endpointer(self.vad or EnergyVad(energy_threshold),
+                                sample_rate=self.sample_rate,
+                                hangover_seconds=silence_seconds,
+                                pre_roll_seconds=pre_roll_seconds,
+                                min_speech_seconds=self.min_speech_seconds,
+                                max_seconds=phrase_time_limit,
+                                stream=stream)
+        onset = time.time()
+        resampled = self.resample_seconds
+        if initial_frames:
+            endpointer.start_with(np.concatenate(initial_frames))
+        deadline = time.time() + timeout
+        speech = None
+        while speech is None:
+            wait = 1 if endpointer.triggered else deadline - time.time()
+            if wait <= 0:
+                break
+            frame = self.read(timeout=wait)
+            if frame is None:
+                speech = endpointer.finish()
+                break
+            started = endpointer.triggered
+            speech = endpointer.push(frame)
+            if endpointer.triggered and not started:
+                onset = time.time()
+                resampled = self.resample_seconds
+        self.dropped_segments += endpointer.dropped
+        # how long the user spoke for and how much of that went on resampling, so both can be traced once the turn starts
+        self.last_capture_seconds = time.time() - onset
+        self.last_resample_seconds = self.resample_seconds - resampled
+        return speech
+
+    async def alisten(self, *args, **kwargs):
+        return await asyncio.to_thread(self.listen, *args, **kwargs)
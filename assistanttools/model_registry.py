@@ -0,0 +1,256 @@
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from config import config
+
+
+def current_rss_mb():
+    """
+    Resident memory of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        # peak rather than current, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process_rss_mb(pid):
+    """
+    Resident memory of another process in MB, or None if it can't be read.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def ollama_ps(timeout=2):
+    """
+    The models Ollama has loaded, from its /api/ps endpoint. The pinned ollama client has no ps().
+    """
+    host = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+    if "://" not in host:
+        host = f"http://{host}"
+    response = requests.get(f"{host.rstrip('/')}/api/ps", timeout=timeout)
+    response.raise_for_status()
+    return response.json().get('models') or []
+
+
+def ollama_model_mb(model_name):
+    """
+    How much memory Ollama reports for a loaded model in MB, or None.
+    """
+    try:
+        for model in ollama_ps():
+            if model_name in (model.get('name'), model.get('model')):
+                return model['size'] / 1024 / 1024
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"Could not ask Ollama how big {model_name} is: {e}")
+    return None
+
+
+class ManagedModel:
+    """
+    One model the registry can load and unload. `size_mb` starts as an estimate and is replaced by
+    what `measure()` returns after each load, if it returns anything.
+    """
+
+    def __init__(self, name, load, unload, size_mb, pinned=False, measure=None):
+        self.name = name
+        self.load = load
+        self.unload = unload
+        self.size_mb = size_mb
+        self.pinned = pinned
+        self.measure = measure
+        self.loaded = False
+        self.users = 0
+        self.last_used = 0.
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Keeps the models that are resident within a RAM budget.
+
+    Models are loaded on demand by `acquire` (or the `use` context manager). If loading one would
+    go over `budget_mb`, the least recently used models that aren't pinned or in use are unloaded
+    first; the Ollama model is unloaded by asking for keep_alive=0. If nothing can be evicted the
+    model is loaded anyway, with a warning, rather than failing the request.
+
+    Sizes are estimates until a model has been loaded once, then they are measured (RSS growth for
+    models loaded into this process, the server's RSS, or what Ollama reports).
+    """
+
+    def __init__(self, budget_mb=None):
+        self.budget_mb = budget_mb
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, load, unload, size_mb, pinned=False, measure=None, loaded=False):
+        model = ManagedModel(name, load, unload, size_mb, pinned=pinned, measure=measure)
+        model.loaded = loaded
+        self.models[name] = model
+        return model
+
+    @property
+    def used_mb(self):
+        return sum(model.size_mb for model in self.models.values() if model.loaded)
+
+    def acquire(self, name):
+        """
+        Make sure `name` is loaded and mark it in use until `release`.
+        """
+        model = self.models[name]
+        with model.lock:
+            with self._lock:
+                if model.loaded:
+                    model.users += 1
+                    model.last_used = time.time()
+                    return model
+            self.make_room(model)
+            before = current_rss_mb()
+            start = time.time()
+            model.load()
+            measured = model.measure() if model.measure is not None else current_rss_mb() - before
+            with self._lock:
+                if measured and measured > 0:
+                    model.size_mb = measured
+                model.loaded = True
+                model.loads += 1
+                model.users += 1
+                model.last_used = time.time()
+                print(f"Loaded {name} in {time.time() - start:.1f}s, {self.describe_usage()}")
+        return model
+
+    def release(self, name):
+        model = self.models[name]
+        with self._lock:
+            model.users = max(0, model.users - 1)
+            model.last_used = time.time()
+
+    @contextmanager
+    def use(self, name):
+        self.acquire(name)
+        try:
+            yield self.models[name]
+        finally:
+            self.release(name)
+
+    def make_room(self, model):
+        """
+        Unload least recently used models until `model` fits. Victims are picked under the registry
+        lock and unloaded after it is released, holding each victim's own lock so nothing can start
+        using it part way through unloading. A model whose lock is taken is being loaded or unloaded
+        by another thread, and is skipped.
+        """
+        if self.budget_mb is None:
+            return
+        victims = []
+        with self._lock:
+            candidates = sorted((m for m in self.models.values()
+                                 if m.loaded and not m.pinned and m.users == 0 and m is not model),
+                                key=lambda m: m.last_used)
+            for candidate in candidates:
+                if self.used_mb + model.size_mb <= self.budget_mb:
+                    break
+                if candidate.lock.acquire(blocking=False):
+                    candidate.loaded = False
+                    victims.append(candidate)
+            over_budget = self.used_mb + model.size_mb > self.budget_mb
+        for victim in victims:
+            try:
+                self.evict(victim, reason="to make room")
+            finally:
+                victim.lock.release()
+        if over_budget:
+            print(f"Loading {model.name} ({model.size_mb:.0f} MB) goes over the {self.budget_mb} MB model budget.")
+
+    def evict(self, model, reason=""):
+        """
+        Unload a model the caller has already marked unloaded, holding its lock but not the registry's.
+        """
+        try:
+            model.unload()
+        except Exception as e:
+            print(f"Could not unload {model.name}: {e}")
+        with self._lock:
+            model.evictions += 1
+        print(f"Unloaded {model.name}{' ' + reason if reason else ''}, {self.describe_usage()}")
+
+    def unload(self, name):
+        model = self.models[name]
+        with model.lock:
+            with self._lock:
+                if not model.loaded or model.users:
+                    return
+                model.loaded = False
+            self.evict(model)
+
+    def warm(self, name, background=True):
+        """
+        Load a model ahead of time, in the background by default.
+        """
+        def _warm():
+            try:
+                self.acquire(name)
+            except Exception as e:
+                print(f"Could not load {name}: {e}")
+                return
+            self.release(name)
+
+        if background:
+            threading.Thread(target=_warm, daemon=True).start()
+        else:
+            _warm()
+
+    def usage(self):
+        """
+        What is loaded and how big it is, so the memory/latency tradeoff can be tuned.
+        """
+        return {
+            'budget_mb': self.budget_mb,
+            'used_mb': round(self.used_mb),
+            'models': {name: {'loaded': model.loaded, 'size_mb': round(model.size_mb), 'pinned': model.pinned,
+                              'in_use': model.users, 'loads': model.loads, 'evictions': model.evictions,
+                              'idle_seconds': round(time.time() - model.last_used) if model.last_used else None}
+                       for name, model in self.models.items()},
+        }
+
+    def describe_usage(self):
+        loaded = ", ".join(f"{model.name} {model.size_mb:.0f}" for model in self.models.values() if model.loaded)
+        budget = f"/{self.budget_mb}" if self.budget_mb is not None else ""
+        return f"{self.used_mb:.0f}{budget} MB of models resident ({loaded or 'none'})"
+
+
+model_registry = ModelRegistry(budget_mb=config['MODEL_MEMORY_BUDGET_MB'])
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.model_registry shows the registered models against the budget and what Ollama has loaded
+    # actions registers the LLM and vision models, with the registry it imported rather than this __main__ copy
+    from assistanttools.actions import model_registry as registry
+    usage = registry.usage()
+    print(f"Budget: {usage['budget_mb']} MB, {usage['used_mb']} MB resident in this process")
+    print(f"{'model':<12}{'size MB':>10}{'loaded':>8}{'pinned':>8}{'loads':>7}{'evicted':>9}")
+    for name, model in usage['models'].items():
+        print(f"{name:<12}{model['size_mb']:>10}{model['loaded']!s:>8}{model['pinned']!s:>8}"
+              f"{model['loads']:>7}{model['evictions']:>9}")
+    try:
+        for model in ollama_ps():
+            print(f"ollama {model['name']}: {model['size'] / 1024 / 1024:.0f} MB")
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"Could not ask Ollama what is loaded: {e}")
+        sys.exit(1)
@@ -0,0 +1,231 @@
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import config
+
+CONTRACTIONS = {"what's": "what is", "whats": "what is", "who's": "who is", "where's": "where is",
+                "how's": "how is", "it's": "it is", "you're": "you are", "can't": "cannot", "don't": "do not"}
+FILLERS = {"please", "um", "uh", "hey", "okay", "ok", "well", "so"}
+# these only make sense with the previous turn, so the same words can mean a different question
+FOLLOW_UP_WORDS = {"it", "its", "that", "those", "they", "them", "he", "she", "him", "her",
+                   "there", "more", "again", "else", "another", "why", "also", "too"}
+
+
+def normalize_query(text):
+    """
+    "Hey, what's the news?" -> "what is the news"
+    """
+    words = []
+    for word in re.sub(r"[^\w'\s]", " ", text.lower()).split():
+        word = CONTRACTIONS.get(word, word).strip("'")
+        if word and word not in FILLERS:
+            words.append(word)
+    return " ".join(words)
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+
+def ollama_embedder(model_name):
+    """
+    An embed(text) function using an Ollama embedding model, e.g. nomic-embed-text.
+    """
+    def embed(text):
+        import ollama
+        return ollama.embeddings(model=model_name, prompt=text)['embedding']
+    return embed
+
+
+class ResponseCache:
+    """
+    Answers to questions that have been asked before, so they are spoken without an LLM generation.
+
+    The key is the normalized question plus a context string (model, intent and the version of any
+    RAG data it was answered from), so new weather or news data is never answered from an old reply.
+    Follow-ups ("tell me more about it") depend on the conversation and are never cached.
+
+    Entries expire after `ttl` seconds and the least recently used are evicted past `max_entries`.
+    With `embed`, a question that misses exactly is compared with the cached questions in the same
+    context and a reply is reused if the cosine similarity of their embeddings is at least
+    `similarity`, which catches rephrasings normalization doesn't.
+
+    The cache and its counters are saved to `path` if set, by a background timer at most every
+    `save_interval` seconds and at exit, so storing an answer never rewrites the file on the turn's path.
+    """
+
+    def __init__(self, ttl=12 * 60 * 60, max_entries=256, path=None, embed=None, similarity=0.92, enabled=True,
+                 save_interval=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.embed = embed
+        self.similarity = similarity
+        self.enabled = enabled
+        self.save_interval = save_interval
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+        self._lock = threading.Lock()
+        self._save_timer = None
+        self.load()
+        if path:
+            atexit.register(self.save)
+
+    def cacheable(self, query):
+        return self.enabled and bool(query) and not FOLLOW_UP_WORDS.intersection(query.split())
+
+    def get(self, transcription, context=""):
+        """
+        The cached reply to this question, or None.
+        """
+        query = normalize_query(transcription)
+        if not self.cacheable(query):
+            return None
+        key = f"{context}|{query}"
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.expired(entry):
+                del self.entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry['hits'] += 1
+                self.stats['hits'] += 1
+                self.dirty = True
+                return entry['response']
+        if self.embed is not None:
+            response = self.get_similar(query, context)
+            if response is not None:
+                return response
+        with self._lock:
+            self.stats['misses'] += 1
+            self.dirty = True
+        return None
+
+    def get_similar(self, query, context):
+        try:
+            embedding = np.asarray(self.embed(query), dtype=np.float32)
+        except Exception as e:
+            print(f"Could not embed the question for the response cache: {e}")
+            return None
+        with self._lock:
+            best, best_score = None, self.similarity
+            for key, entry in self.entries.items():
+                if entry['context'] != context or entry.get('embedding') is None or self.expired(entry):
+                    continue
+                score = cosine(embedding, entry['embedding'])
+                if score >= best_score:
+                    best, best_score = key, score
+            if best is None:
+                return None
+            self.entries.move_to_end(best)
+            self.entries[best]['hits'] += 1
+            self.stats['near_hits'] += 1
+            self.dirty = True
+            return self.entries[best]['response']
+
+    def put(self, transcription, context, response):
+        query = normalize_query(transcription)
+        if not self.cacheable(query) or not response.strip():
+            return
+        embedding = None
+        if self.embed is not None:
+            try:
+                embedding = [float(x) for x in self.embed(query)]
+            except Exception as e:
+                print(f"Could not embed the question for the response cache: {e}")
+        with self._lock:
+            key = f"{context}|{query}"
+            self.entries[key] = {'query': query, 'context': context, 'response': response,
+                                 'created': time.time(), 'hits': 0, 'embedding': embedding}
+            self.entries.move_to_end(key)
+            self.stats['stores'] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            self.dirty = True
+        self.schedule_save()
+
+    def expired(self, entry):
+        return time.time() - entry['created'] > self.ttl
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.dirty = True
+        self.save()
+
+    def hit_rate(self):
+        hits = self.stats['hits'] + self.stats['near_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.stats.update(saved.get('stats', {}))
+        for entry in saved.get('entries', []):
+            if not self.expired(entry):
+                self.entries[f"{entry['context']}|{entry['query']}"] = entry
+
+    def schedule_save(self):
+        """
+        Save `save_interval` seconds from now in the background, unless a save is already pending.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_interval, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        with self._lock:
+            self._save_timer = None
+            if not self.path or not self.dirty:
+                return
+            self.dirty = False
+            saved = {'stats': dict(self.stats),
+                     'entries': [entry for entry in self.entries.values() if not self.expired(entry)]}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # write a copy and swap it in, so a crash part way through can't lose the cache
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(saved, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+response_cache = ResponseCache(ttl=config['RESPONSE_CACHE_TTL'],
+                               max_entries=config['RESPONSE_CACHE_SIZE'],
+                               path=config['RESPONSE_CACHE_PATH'],
+                               embed=ollama_embedder(config['RESPONSE_CACHE_EMBED_MODEL'])
+                               if config['RESPONSE_CACHE_EMBED_MODEL'] else None,
+                               similarity=config['RESPONSE_CACHE_SIMILARITY'],
+                               enabled=config['RESPONSE_CACHE'],
+                               save_interval=config['RESPONSE_CACHE_SAVE_SECONDS'])
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.response_cache [--clear]
+    if "--clear" in sys.argv:
+        response_cache.clear()
+    stats = response_cache.stats
+    print(f"{len(response_cache.entries)} entries, hit rate {response_cache.hit_rate():.0%} "
+          f"({stats['hits']} hits, {stats['near_hits']} near, {stats['misses']} misses), "
+          f"{stats['evictions']} evicted, {stats['expired']} expired")
+    for entry in reversed(response_cache.entries.values()):
+        print(f"{entry['hits']:>5}  {entry['query']!r} [{entry['context']}] -> {entry['response'][:60]!r}")
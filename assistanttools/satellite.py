@@ -0,0 +1,156 @@
+import asyncio
+import socket
+import sys
+from config import config
+from assistanttools.microphone import MicrophoneStream
+from assistanttools.satellite_protocol import (AUDIO, DONE, END, HELLO, RESET, SPEECH, TEXT, AudioCodec,
+                                               decode_speech, pack_message, read_message, send_json, send_message)
+from assistanttools.utils import tts_engine
+from assistanttools.vad import create_vad
+
+
+class AudioUplink:
+    """
+    The `stream` hook for MicrophoneStream.listen: sends each utterance to the hub while it is being
+    captured, so the hub has all of it as soon as the endpoint is reached.
+
+    Called from the capture thread. Messages go through a queue of at most `max_pending` to a task
+    on the event loop that writes and drains them, so on a slow link capture waits for the network
+    instead of the write buffer growing without limit. Create it on the event loop.
+    """
+
+    def __init__(self, loop, writer, codec="adpcm", max_pending=32):
+        self.loop = loop
+        self.writer = writer
+        self.codec = AudioCodec(codec)
+        self.pushed = 0
+        self.broken = False
+        self.pending = asyncio.Queue(maxsize=max_pending)
+        self.sender = loop.create_task(self.send_pending())
+
+    def push(self, audio):
+        self.pushed += len(audio)
+        self.send(AUDIO, self.codec.encode(audio))
+
+    def reset(self):
+        # the endpointer dropped the segment as noise
+        self.pushed = 0
+        self.codec.reset()
+        self.send(RESET)
+
+    def close(self):
+        pass
+
+    def send(self, kind, payload=b""):
+        asyncio.run_coroutine_threadsafe(self.pending.put(pack_message(kind, payload)), self.loop).result()
+
+    async def send_pending(self):
+        while True:
+            message = await self.pending.get()
+            try:
+                if not self.broken:
+                    self.writer.write(message)
+                    await self.writer.drain()
+            except ConnectionError:
+                # keep taking messages so capture doesn't block, the receiver reports the hang up
+                self.broken = True
+            finally:
+                self.pending.task_done()
+
+    async def flush(self):
+        """
+        Wait until everything pushed has been written, then stop the sender.
+        """
+        await self.pending.join()
+        self.sender.cancel()
+
+
+class Satellite:
+    """
+    Capture and playback only, everything else runs on the hub (see assistanttools/hub.py).
+
+    Utterances are cut out of the microphone stream by the VAD and streamed to the hub as ADPCM.
+    The hub checks for the wake word, so no model runs here. Capture is half duplex: after an
+    utterance is sent the microphone is ignored until the hub's reply has been played.
+    """
+
+    def __init__(self, host, port, microphone, satellite_id=None, codec="adpcm",
+                 timeout=10, phrase_time_limit=7, reply_timeout=60, tts=None):
+        self.host = host
+        self.port = port
+        self.microphone = microphone
+        self.satellite_id = satellite_id or socket.gethostname()
+        self.codec = codec
+        self.timeout = timeout
+        self.phrase_time_limit = phrase_time_limit
+        self.reply_timeout = reply_timeout
+        self.tts = tts or tts_engine
+        self.replied = None
+
+    async def run(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        await send_json(writer, HELLO, {'id': self.satellite_id, 'codec': self.codec})
+        print(f"Connected to the hub at {self.host}:{self.port}")
+        self.replied = asyncio.Event()
+        receiver = asyncio.create_task(self.receive(reader))
+        try:
+            while not receiver.done():
+                uplink = AudioUplink(asyncio.get_running_loop(), writer, self.codec)
+                speech = await self.microphone.alisten(timeout=self.timeout,
+                                                       phrase_time_limit=self.phrase_time_limit,
+                                                       energy_threshold=config["ENERGY_THRESHOLD"],
+                                                       silence_seconds=config["VAD_HANGOVER_SECONDS"],
+                                                       stream=uplink)
+                # END has to follow the utterance's audio
+                await uplink.flush()
+                if speech is None:
+                    continue
+                self.replied.clear()
+                await send_message(writer, END)
+                try:
+                    await asyncio.wait_for(self.replied.wait(), timeout=self.reply_timeout)
+                except asyncio.TimeoutError:
+                    print("The hub didn't reply.")
+                # drop anything the microphone picked up while the reply was playing
+                self.microphone.clear()
+        finally:
+            receiver.cancel()
+            writer.close()
+
+    async def receive(self, reader):
+        while True:
+            try:
+                kind, payload = await read_message(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                print("The hub hung up.")
+                self.replied.set()
+                return
+            if kind == TEXT:
+                print(payload.decode("utf-8"))
+            elif kind == SPEECH:
+                await asyncio.to_thread(self.tts.play, *decode_speech(payload, self.codec))
+            elif kind == DONE:
+                self.replied.set()
+
+
+def parse_address(address, port=config["HUB_PORT"]):
+    """
+    "host" or "host:port" -> (host, port)
+    """
+    host, _, given = address.partition(":")
+    return host, int(given) if given else port
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.satellite HOST[:PORT]
+    host, port = parse_address(sys.argv[1] if len(sys.argv) > 1 else "localhost")
+    microphone = MicrophoneStream(vad=create_vad(config["VAD_BACKEND"],
+                                                 energy_threshold=config["ENERGY_THRESHOLD"],
+                                                 aggressiveness=config["VAD_AGGRESSIVENESS"]),
+                                  min_speech_seconds=config["VAD_MIN_SPEECH_SECONDS"]).start()
+    satellite = Satellite(host, port, microphone,
+                          satellite_id=config["SATELLITE_ID"],
+                          codec=config["SATELLITE_CODEC"],
+                          timeout=config["TIMEOUT"],
+                          phrase_time_limit=config["PHRASE_TIME_LIMIT"])
+    asyncio.run(satellite.run())
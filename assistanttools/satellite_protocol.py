@@ -0,0 +1,98 @@
+# audioop is deprecated and was removed from the standard library in Python 3.13, where the
+# audioop-lts package in requirements.txt provides the same module
+import audioop
+import json
+import struct
+import numpy as np
+from assistanttools.utils import pcm_to_array
+
+# Satellite -> hub
+HELLO = 1  # JSON: satellite id, codec, sample rate
+AUDIO = 2  # a chunk of the utterance being captured
+END = 3  # the utterance is complete, transcribe it
+RESET = 4  # throw away the audio sent since the last END, it was noise
+# Hub -> satellite
+TEXT = 10  # JSON: what the hub heard, for display
+SPEECH = 11  # sample rate (uint32) followed by encoded 16-bit PCM to play
+DONE = 12  # the reply is finished
+
+# Every message is a one byte type and a four byte length, then the payload.
+HEADER = struct.Struct("!BI")
+RATE = struct.Struct("!I")
+
+
+def pack_message(kind, payload=b""):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+async def send_message(writer, kind, payload=b""):
+    writer.write(pack_message(kind, payload))
+    await writer.drain()
+
+
+async def send_json(writer, kind, data):
+    await send_message(writer, kind, json.dumps(data).encode("utf-8"))
+
+
+async def read_message(reader):
+    """
+    Returns (type, payload). Raises asyncio.IncompleteReadError when the other side hangs up.
+    """
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length) if length else b""
+    return kind, payload
+
+
+class AudioCodec:
+    """
+    IMA ADPCM from the standard library: 4 bits a sample, a quarter of 16-bit PCM, and cheap
+    enough for a Pi Zero. "pcm" sends 16-bit samples unchanged.
+
+    The encoder and decoder keep state between chunks of one utterance, call `reset` between utterances.
+    """
+
+    def __init__(self, codec="adpcm"):
+        if codec not in ("adpcm", "pcm"):
+            raise ValueError(f"Unknown codec {codec}")
+        self.codec = codec
+        self.reset()
+
+    def reset(self):
+        self.encode_state = None
+        self.decode_state = None
+
+    def encode_pcm(self, pcm):
+        if self.codec == "pcm":
+            return pcm
+        data, self.encode_state = audioop.lin2adpcm(pcm, 2, self.encode_state)
+        return data
+
+    def decode_pcm(self, data):
+        if self.codec == "pcm":
+            return data
+        pcm, self.decode_state = audioop.adpcm2lin(data, 2, self.decode_state)
+        return pcm
+
+    def encode(self, audio):
+        """
+        float32 samples -> bytes
+        """
+        return self.encode_pcm((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+
+    def decode(self, data):
+        """
+        bytes -> float32 samples
+        """
+        return pcm_to_array(self.decode_pcm(data))
+
+
+def encode_speech(pcm, rate, codec="adpcm"):
+    return RATE.pack(rate) + AudioCodec(codec).encode_pcm(pcm)
+
+
+def decode_speech(payload, codec="adpcm"):
+    """
+    Returns (pcm, sample_rate) ready for TTSEngine.play.
+    """
+    rate, = RATE.unpack(payload[:RATE.size])
+    return AudioCodec(codec).decode_pcm(payload[RATE.size:]), rate
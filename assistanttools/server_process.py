@@ -0,0 +1,141 @@
+import subprocess
+import threading
+import time
+import requests
+
+
+class ManagedServer:
+    """
+    Keeps a long-lived model server (whisper.cpp, llama.cpp) running on a local port,
+    so the model is loaded once instead of on every request.
+    The process is health checked and restarted automatically if it dies or stops answering.
+    """
+
+    def __init__(self, command, host="127.0.0.1", port=8080, health_path="/",
+                 startup_timeout=120, watch_interval=10, name="server", preexec_fn=None):
+        self.command = command
+        self.preexec_fn = preexec_fn
+        self.host = host
+        self.port = port
+        self.health_path = health_path
+        self.startup_timeout = startup_timeout
+        self.watch_interval = watch_interval
+        self.name = name
+        self.process = None
+        self.restarts = 0
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stopped = threading.Event()
+        self.ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, watch=True):
+        """
+        Launch the server and block until it answers its health check.
+        """
+        with self._lock:
+            self._start_locked()
+        if watch and self._watcher is None:
+            self._stopped.clear()
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+        return self
+
+    def _start_locked(self):
+        if self.is_alive():
+            return
+        print(f"Starting {self.name}: ", " ".join(self.command))
+        self.process = subprocess.Popen(self.command,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL,
+                                        preexec_fn=self.preexec_fn)
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"{self.name} exited with code {self.process.returncode} during startup.")
+            if self.is_healthy():
+                print(f"{self.name} ready on {self.url}")
+                self.ready.set()
+                return
+            time.sleep(0.25)
+        self._stop_locked()
+        raise TimeoutError(
+            f"{self.name} did not become healthy within {self.startup_timeout}s.")
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            self._stop_locked()
+        if self._watcher is not None:
+            self._watcher.join(timeout=1)
+            self._watcher = None
+
+    def _stop_locked(self):
+        self.ready.clear()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def restart(self):
+        with self._lock:
+            self._stop_locked()
+            self.restarts += 1
+            self._start_locked()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_healthy(self, timeout=1.0):
+        try:
+            response = self.session.get(
+                f"{self.url}{self.health_path}", timeout=timeout)
+        except requests.RequestException:
+            return False
+        return response.status_code < 500
+
+    def ensure_running(self):
+        """
+        Cheap liveness check before each request. Starts the server if it isn't running, or waits
+        if another thread is already starting it.
+        """
+        if self.is_alive() and self.ready.is_set():
+            return
+        with self._lock:
+            if not self.is_alive():
+                if self.process is not None:
+                    print(f"{self.name} is not running, restarting.")
+                    self.restarts += 1
+                self._start_locked()
+
+    def post(self, path, retries=1, **kwargs):
+        """
+        POST to the server, restarting it and retrying if the connection fails.
+        """
+        self.ensure_running()
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.post(f"{self.url}{path}", **kwargs)
+                response.raise_for_status()
+                return response
+            except requests.ConnectionError:
+                if attempt == retries:
+                    raise
+                self.restart()
+
+    def _watch(self):
+        while not self._stopped.wait(self.watch_interval):
+            if not self.is_alive() or not self.is_healthy(timeout=5):
+                print(f"{self.name} failed its health check, restarting.")
+                try:
+                    self.restart()
+                except (RuntimeError, TimeoutError) as e:
+                    print(f"Could not restart {self.name}: {e}")
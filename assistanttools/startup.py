@@ -0,0 +1,112 @@
+import subprocess
+import sys
+import threading
+import time
+
+
+class BackgroundLoad:
+    """
+    Runs a slow factory (a model load, a heavy import) on a background thread.
+
+    `start` kicks it off without blocking, `get` waits for the result and re-raises anything the
+    factory raised. Calling `get` first simply loads in the calling thread's time.
+    """
+
+    def __init__(self, factory, name="model"):
+        self.factory = factory
+        self.name = name
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self):
+        start = time.time()
+        try:
+            self.value = self.factory()
+            print(f"{self.name} loaded in {time.time() - start:.1f}s.")
+        except Exception as e:
+            print(f"Could not load {self.name}: {e}")
+            self.error = e
+        self.done.set()
+
+    def get(self, timeout=None):
+        self.start()
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"{self.name} did not load within {timeout}s.")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class StartupProfile:
+    """
+    Times each startup phase when `enabled`, for `python main.py --profile-startup`.
+    `began` is when the process started importing, so the first phase is the imports.
+    """
+
+    def __init__(self, began, enabled=False):
+        self.began = began
+        self.enabled = enabled
+        self.phases = [("imports", time.perf_counter() - began)]
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def report(self):
+        print(f"\n{'startup phase':<32}{'seconds':>10}")
+        for name, seconds in self.phases:
+            print(f"{name:<32}{seconds:>10.3f}")
+        print(f"{'ready after':<32}{time.perf_counter() - self.began:>10.3f}")
+
+
+class _Phase:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.profile.enabled:
+            self.profile.phases.append((self.name, time.perf_counter() - self.start))
+
+
+def import_times(module="main"):
+    """
+    Import `module` in a fresh interpreter with -X importtime and return
+    [(cumulative seconds, self seconds, depth, name)] in import order.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((int(cumulative) / 1e6, int(own) / 1e6, depth, name.strip()))
+    return times
+
+
+def print_import_times(module="main", top=25, max_depth=2):
+    """
+    The slowest imports `module` pulls in, down to `max_depth` levels, with their cumulative time.
+    """
+    times = import_times(module)
+    total = sum(own for _, own, _, _ in times)
+    print(f"importing {module} took {total:.3f}s in a fresh interpreter")
+    print(f"{'cumulative':>10}{'self':>10}  module")
+    slowest = sorted((x for x in times if x[2] <= max_depth), reverse=True)[:top]
+    for cumulative, own, depth, name in slowest:
+        print(f"{cumulative:>10.3f}{own:>10.3f}  {'  ' * (depth - 1)}{name}")
@@ -0,0 +1,135 @@
+import re
+import threading
+import numpy as np
+from assistanttools.utils import SAMPLE_RATE
+
+
+def normalize_word(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def agreed_prefix(words, previous):
+    """
+    The leading words two consecutive hypotheses agree on.
+    """
+    count = 0
+    for (word, _, _), (before, _, _) in zip(words, previous):
+        if normalize_word(word) != normalize_word(before):
+            break
+        count += 1
+    return words[:count]
+
+
+class StreamingTranscriber:
+    """
+    Transcribes an utterance while it is still being spoken.
+
+    Audio is pushed as it arrives and re-decoded on a worker thread every `step_seconds`. Words that
+    two decodes in a row agree on are committed, and the audio up to the end of the last committed
+    word is dropped, so each decode only covers the uncommitted tail (with the committed text as the
+    prompt). The rest of the latest hypothesis is tentative. When the utterance ends, `finish` only
+    has to decode that short tail, so the final transcript follows the endpoint closely.
+
+    `decode(audio, prompt)` returns [(word, start, end)] with times in seconds from the start of `audio`.
+    `on_partial(committed, tentative)` is called from the worker thread after each decode.
+    """
+
+    def __init__(self, decode, step_seconds=0.5, on_partial=None, sample_rate=SAMPLE_RATE):
+        self.decode = decode
+        self.step = int(step_seconds * sample_rate)
+        self.on_partial = on_partial
+        self.sample_rate = sample_rate
+        self.decodes = 0
+        self._lock = threading.Lock()
+        self._decoding = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the current utterance, e.g. because the endpointer dropped it as noise.
+        """
+        with self._lock:
+            self.buffer = np.zeros(0, dtype=np.float32)
+            self.pushed = 0
+            self.decoded = 0
+            self.committed = []
+            self.hypothesis = []
+            self.generation += 1
+
+    @property
+    def committed_text(self):
+        return " ".join(self.committed)
+
+    @property
+    def tentative_text(self):
+        return " ".join(word for word, _, _ in self.hypothesis)
+
+    def push(self, audio):
+        with self._lock:
+            self.buffer = np.concatenate((self.buffer, audio))
+            self.pushed += len(audio)
+            ready = self.pushed - self.decoded >= self.step
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        if ready:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Streaming transcription failed: {e}")
+
+    def update(self):
+        with self._decoding:
+            with self._lock:
+                audio = self.buffer
+                pushed = self.pushed
+                prompt = self.committed_text
+                generation = self.generation
+            words = self.decode(audio, prompt)
+            self.decodes += 1
+
+            with self._lock:
+                if generation != self.generation:
+                    return
+                self.decoded = pushed
+                agreed = agreed_prefix(words, self.hypothesis)
+                if agreed:
+                    self.committed += [word for word, _, _ in agreed]
+                    cut = agreed[-1][2]
+                    self.buffer = self.buffer[int(cut * self.sample_rate):]
+                    words = [(word, start - cut, end - cut) for word, start, end in words[len(agreed):]]
+                self.hypothesis = words
+                committed, tentative = self.committed_text, self.tentative_text
+
+        if self.on_partial is not None:
+            self.on_partial(committed, tentative)
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def finish(self):
+        """
+        Decode whatever hasn't been committed yet and return the whole transcript.
+        """
+        self.close()
+        with self._decoding:
+            with self._lock:
+                audio = self.buffer
+                prompt = self.committed_text
+                committed = list(self.committed)
+            # a tail shorter than a tenth of a second is the silence after the last committed word
+            words = self.decode(audio, prompt) if len(audio) > self.sample_rate // 10 else []
+        return " ".join(committed + [word for word, _, _ in words]).strip()
@@ -0,0 +1,208 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from config import config
+
+
+class Turn:
+    """
+    Timings for one conversational turn: named spans (start offset and duration) and one-off marks
+    such as time to first token, all relative to the start of the turn.
+    """
+
+    def __init__(self, **tags):
+        self.id = str(uuid.uuid4())
+        self.tags = tags
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.spans = []
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'start': round(start - self.started, 6),
+                'duration': round(duration, 6),
+            })
+
+    def mark(self, name):
+        with self._lock:
+            if name not in self.marks:
+                self.marks[name] = round(time.perf_counter() - self.started, 6)
+
+    def record(self):
+        return {
+            'turn': self.id,
+            'time': self.wall_time,
+            'total': round(time.perf_counter() - self.started, 6),
+            'tags': self.tags,
+            'spans': self.spans,
+            'marks': self.marks,
+        }
+
+
+class _Span:
+    __slots__ = ('turn', 'name', 'start')
+
+    def __init__(self, turn, name):
+        self.turn = turn
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.turn.add_span(self.name, self.start, time.perf_counter() - self.start)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Per-turn latency tracing for the voice pipeline.
+
+    The current turn lives in a context variable, so spans recorded from asyncio tasks and
+    asyncio.to_thread workers started during the turn land in the right place. When tracing is
+    disabled, or no turn is active, `span` returns a shared no-op context manager.
+    Finished turns are appended to a JSONL file that rotates at `max_bytes`.
+    """
+
+    def __init__(self, enabled=False, path="storage/traces.jsonl", max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.enabled = enabled
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.current = contextvars.ContextVar('turn', default=None)
+        self._lock = threading.Lock()
+
+    def start_turn(self, **tags):
+        if not self.enabled:
+            return None
+        turn = Turn(**tags)
+        self.current.set(turn)
+        return turn
+
+    def end_turn(self):
+        turn = self.current.get()
+        if turn is None:
+            return None
+        self.current.set(None)
+        record = turn.record()
+        self.write(record)
+        return record
+
+    def span(self, name):
+        turn = self.current.get() if self.enabled else None
+        if turn is None:
+            return NULL_SPAN
+        return _Span(turn, name)
+
+    def mark(self, name):
+        turn = self.current.get() if self.enabled else None
+        if turn is not None:
+            turn.mark(name)
+
+    def record(self, name, duration):
+        """
+        Add a span that was timed elsewhere, e.g. audio captured before the turn started.
+        """
+        turn = self.current.get() if self.enabled else None
+        if turn is not None:
+            turn.add_span(name, time.perf_counter() - duration, duration)
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self.rotate()
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.
+    index = (len(values) - 1) * p / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def load_records(path, backup_count=3):
+    paths = [f"{path}.{i}" for i in range(backup_count, 0, -1)] + [path]
+    records = []
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+        with open(p) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def summarize(records):
+    """
+    p50/p95/p99 in seconds for every span (summed per turn), mark and the total turn time.
+    """
+    samples = {}
+    for record in records:
+        per_turn = {}
+        for span in record['spans']:
+            per_turn[span['name']] = per_turn.get(span['name'], 0.) + span['duration']
+        for name, value in record['marks'].items():
+            per_turn[name] = value
+        per_turn['turn_total'] = record['total']
+        for name, value in per_turn.items():
+            samples.setdefault(name, []).append(value)
+
+    return {name: {'count': len(values),
+                   'p50': percentile(values, 50),
+                   'p95': percentile(values, 95),
+                   'p99': percentile(values, 99)}
+            for name, values in samples.items()}
+
+
+def print_summary(summary):
+    print(f"{'stage':<24}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in sorted(summary.items(), key=lambda x: x[1]['p50']):
+        print(f"{name:<24}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+
+
+tracer = Tracer(enabled=config['TRACE_ENABLED'],
+                path=config['TRACE_PATH'],
+                max_bytes=config['TRACE_MAX_MB'] * 1024 * 1024,
+                backup_count=config['TRACE_BACKUP_COUNT'])
+
+
+if __name__ == '__main__':
+    # python -m assistanttools.tracing [traces.jsonl]
+    print_summary(summarize(load_records(sys.argv[1] if len(sys.argv) > 1 else config['TRACE_PATH'],
+                                         config['TRACE_BACKUP_COUNT'])))
@@ -1,23 +1,52 @@
 import subprocess
 import re
-import librosa
+from assistanttools.server_process import ManagedServer
+from assistanttools.utils import array_to_wav_bytes
 
-import soundfile as sf
+
+def clean_transcription(output):
+    """
+    Strip whisper.cpp timestamps and collapse whitespace.
+    """
+    output = re.sub(r'\[.*?\]', '', output)
+    output = re.sub(' +', ' ', output)
+    output = output.replace('\n', ' ')
+    output = output.strip()
+    return output
 
 
-def transcribe_gguf(whisper_cpp_path, model_path, file_path):
+def transcribe_gguf(whisper_cpp_path, model_path, file_path, threads=None, preexec_fn=None):
     command = f"./{whisper_cpp_path}main -m {model_path} -f {file_path}"
+    if threads:
+        command += f" -t {threads}"
     print("Command: ", command)
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, preexec_fn=preexec_fn)
     process.wait()
     output = process.stdout.read()
     output = output.decode('utf-8')
-    output = re.sub(r'\[.*?\]', '', output)
-    output = re.sub(' +', ' ', output)
-    output = output.replace('\n', ' ')
-    output = output.strip()
 
-    return output
+    return clean_transcription(output)
+
+
+class WhisperCppServer(ManagedServer):
+    """
+    Resident whisper.cpp server. The GGML model is loaded once, and each utterance is sent
+    as an in-memory WAV over localhost instead of launching a new process.
+    """
+
+    def __init__(self, whisper_cpp_path, model_path, host="127.0.0.1", port=8910, threads=None, preexec_fn=None):
+        command = [f"./{whisper_cpp_path}server", "-m", model_path,
+                   "--host", host, "--port", str(port)]
+        if threads:
+            command += ["-t", str(threads)]
+        super().__init__(command, host=host, port=port, name="whisper.cpp server", preexec_fn=preexec_fn)
+
+    def transcribe(self, speech):
+        response = self.post("/inference",
+                             files={"file": ("audio.wav", array_to_wav_bytes(speech), "audio/wav")},
+                             data={"response_format": "json", "temperature": "0.0"},
+                             timeout=60)
+        return clean_transcription(response.json().get("text", ""))
 
 
 if __name__ == '__main__':
@@ -1,21 +1,46 @@
+import asyncio
+# audioop is deprecated and was removed from the standard library in Python 3.13, where the
+# audioop-lts package in requirements.txt provides the same module
+import audioop
+import contextvars
+import hashlib
+import io
+import queue
 import re
 import os
+import subprocess
+import threading
+import time
+import wave
+from collections import OrderedDict
+import numpy as np
 import speech_recognition as sr
+from assistanttools.intents import is_noise
+from assistanttools.tracing import tracer
 from config import config
 
+SAMPLE_RATE = 16000
 
-def check_if_vision_mode(transcription):
-    """
-    Check if the transcription is a command to enter vision mode.
-    """
-    return any([x in transcription.lower() for x in ["photo", "picture", "image", "snap", "shoot"]])
+sentence_stoppers = ['. ', '.\n', '? ', '! ', '?\n', '!\n', '.\n']
 
 
-def check_if_exit(transcription):
+class Heartbeat:
     """
-    Check if the transcription is an exit command.
+    When the reply last made progress (a chunk generated or a sentence spoken), so a watchdog can
+    tell a stalled reply from a long one.
     """
-    return any([x in transcription.lower() for x in ["stop", "exit", "quit"]])
+
+    def __init__(self):
+        self.last = time.monotonic()
+
+    def beat(self):
+        self.last = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last
+
+
+reply_heartbeat = Heartbeat()
 
 
 def check_if_ignore(transcription):
@@ -24,46 +49,110 @@ def check_if_ignore(transcription):
     This happens if the whisper prediction is "you" or "." or "", or is some sound effect like wind blowing, usually inside parentheses.
     These are things caused by having the fan so close to the microphone, definitely need to fix.
     """
-    if transcription.strip().lower() == "you" or transcription.strip() == "." or transcription.strip() == "":
-        return True
-    if re.match(r"\(.*\)", transcription):
-        return True
-    return False
+    return is_noise(transcription.strip())
+
+
+def dictate_ollama_stream(stream, early_stopping=False, max_spoken_tokens=250, cancelled=None):
+    return dictate_stream((chunk['message']['content'] for chunk in stream),
+                          early_stopping=early_stopping,
+                          max_spoken_tokens=max_spoken_tokens,
+                          cancelled=cancelled)
 
 
-def dictate_ollama_stream(stream, early_stopping=False, max_spoken_tokens=250):
+def dictate_stream(text_chunks, early_stopping=False, max_spoken_tokens=250, cancelled=None):
+    """
+    Speak streamed text a sentence at a time while generation continues.
+    Sentences are handed to the speech queue, so the stream keeps being read while espeak talks.
+    Returns once everything has been spoken.
+    `cancelled` is the turn's threading.Event: once it is set the stream isn't read any further and
+    nothing more is spoken, for replies that run in a thread a barge-in can't cancel.
+    """
     response = ""
-    streaming_word = ""
-    for i, chunk in enumerate(stream):
-        text_chunk = chunk['message']['content']
-        streaming_word += text_chunk
+    pending = ""
+    for i, text_chunk in enumerate(text_chunks):
+        reply_heartbeat.beat()
+        pending += text_chunk
         response += text_chunk
+        if cancelled is not None and cancelled.is_set():
+            early_stopping = True
+            break
         if i > max_spoken_tokens:
             early_stopping = True
             break
 
-        if is_complete_word(text_chunk):
-            streaming_word_clean = streaming_word.replace(
-                '"', "").replace("\n", " ").replace("'", "").replace("*", "").replace('-', '').replace(':', '').replace('!', '')
-            speak(streaming_word_clean)
-            streaming_word = ""
+        sentences, pending = split_sentences(pending)
+        if sentences:
+            speech_queue.say(clean_for_speech(sentences), cancelled)
     if not early_stopping:
-        streaming_word_clean = streaming_word.replace(
-            '"', "").replace("\n", " ").replace("'", "").replace("*", "").replace('-', '').replace(':', '').replace('!', '')
+        speech_queue.say(clean_for_speech(pending), cancelled)
+
+    speech_queue.wait()
+    return response
+
 
-        speak(streaming_word_clean)
+async def dictate_stream_async(text_chunks, max_spoken_tokens=250, say=None):
+    """
+    Async version of dictate_stream for an async iterator of text chunks.
+    A speaker task plays sentences while the stream is still being read. If this coroutine is
+    cancelled (barge-in), playback stops straight away.
+    `say(text, cache)` speaks a sentence, on this device's speaker by default.
+    """
+    sentences = asyncio.Queue(maxsize=config['SPEECH_QUEUE_SIZE'])
+    speaker = asyncio.create_task(speak_from_queue(sentences, say or say_locally))
+    response = ""
+    pending = ""
+    early_stopping = False
+    i = 0
+    try:
+        async for text_chunk in text_chunks:
+            reply_heartbeat.beat()
+            pending += text_chunk
+            response += text_chunk
+            if i > max_spoken_tokens:
+                early_stopping = True
+                break
+            i += 1
+
+            spoken, pending = split_sentences(pending)
+            if spoken:
+                await sentences.put(clean_for_speech(spoken))
+        if not early_stopping:
+            await sentences.put(clean_for_speech(pending))
+        await sentences.put(None)
+        await speaker
+    finally:
+        if not speaker.done():
+            speaker.cancel()
+            tts_engine.interrupt()
 
     return response
 
 
-def is_complete_word(text_chunk):
+async def speak_from_queue(sentences, say):
+    while True:
+        text = await sentences.get()
+        if text is None:
+            return
+        await say(text, False)
+
+
+async def say_locally(text, cache=False):
+    await asyncio.to_thread(speak, text, cache)
+
+
+def split_sentences(text, max_length=200):
     """
-    Given the subword outputs from streaming, as these chunks are added together, check if they form a coherent word. If so, return the word.
+    Split streamed text into the complete sentences so far and the unfinished remainder.
+    Very long sentences are cut at the last space so speech doesn't wait too long to start.
     """
+    end = max(text.rfind(x) + len(x) if x in text else 0 for x in sentence_stoppers)
+    if end == 0 and len(text) > max_length:
+        end = text.rfind(' ') + 1
+    return text[:end], text[end:]
 
-    if ' ' in text_chunk or all([x not in text_chunk for x in ['a', 'e', 'i', 'o', 'u']]):
-        return True
-    return False
+
+def clean_for_speech(text):
+    return text.replace('"', "").replace("\n", " ").replace("'", "").replace("*", "").replace('-', '').replace(':', '').replace('!', '')
 
 
 def remove_parentheses(transcription):
@@ -72,6 +161,72 @@ def remove_parentheses(transcription):
     """
     return re.sub(r"\(.*\)", "", transcription).strip()
 
+def pcm_to_array(raw):
+    """
+    Convert signed 16-bit little endian PCM bytes into a float32 NumPy buffer in [-1, 1].
+    """
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def iter_microphone_frames(source, sample_rate=SAMPLE_RATE):
+    """
+    Yield (16 kHz float32 frame, seconds spent converting it) from an open sr.Microphone, resampling
+    each chunk as it arrives.
+    """
+    state = None
+    while True:
+        raw = source.stream.read(source.CHUNK)
+        started = time.perf_counter()
+        if source.SAMPLE_WIDTH != 2:
+            raw = audioop.lin2lin(raw, source.SAMPLE_WIDTH, 2)
+        if source.SAMPLE_RATE != sample_rate:
+            raw, state = audioop.ratecv(
+                raw, 2, 1, source.SAMPLE_RATE, sample_rate, state)
+        frame = pcm_to_array(raw)
+        yield frame, time.perf_counter() - started
+
+
+def write_wav(file_path, speech, sample_rate=SAMPLE_RATE):
+    """
+    Write a float32 buffer to a WAV file. Only used by backends that need a file path.
+    """
+    import soundfile as sf
+    with tracer.span("wav_io"):
+        sf.write(file_path, speech, sample_rate)
+    return file_path
+
+
+def read_wav(file_path, sample_rate=SAMPLE_RATE):
+    """
+    Read a WAV file into a mono float32 buffer at the given sample rate, e.g. a recorded fixture.
+    """
+    with wave.open(file_path, "rb") as f:
+        raw = f.readframes(f.getnframes())
+        channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+    if width != 2:
+        raw = audioop.lin2lin(raw, width, 2)
+    if channels == 2:
+        raw = audioop.tomono(raw, 2, 0.5, 0.5)
+    if rate != sample_rate:
+        raw, _ = audioop.ratecv(raw, 2, 1, rate, sample_rate, None)
+    return pcm_to_array(raw)
+
+
+def array_to_wav_bytes(speech, sample_rate=SAMPLE_RATE):
+    """
+    Encode a float32 buffer as an in-memory 16-bit mono WAV, for backends that expect a WAV upload.
+    """
+    with tracer.span("wav_io"):
+        pcm = (np.clip(speech, -1.0, 1.0) * 32767).astype(np.int16)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(pcm.tobytes())
+        return buffer.getvalue()
+
+
 def check_microphone():
     recognizer = sr.Recognizer()
     with sr.Microphone() as source:
@@ -86,5 +241,204 @@ def check_microphone():
         except sr.UnknownValueError:
             print("No audio detected.")
 
-def speak(text):
-    os.system(f"espeak -a {config['SPEECH_VOLUME']} '{text}'")
\ No newline at end of file
+FIXED_PHRASES = [
+    "Hello. I am ready to assist you.",
+    "Yes?",
+    "Taking a picture.",
+    "Analyzing the image.",
+    "Getting weather data.",
+    "Getting news data.",
+    "Program stopped. See you later!",
+]
+
+
+class TTSEngine:
+    """
+    Renders text to PCM with espeak and plays it through one shared output stream.
+    Rendered phrases are kept in an LRU cache bounded by size (and optionally on disk),
+    so repeated phrases like "Yes?" play without running the synthesizer again.
+    """
+
+    def __init__(self, volume=10, cache_bytes=16 * 1024 * 1024, cache_dir=None):
+        self.volume = volume
+        self.cache_bytes = cache_bytes
+        self.cache_dir = cache_dir
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self._pyaudio = None
+        self._stream = None
+        self._stream_rate = None
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._interrupted = threading.Event()
+
+    def synthesize(self, text):
+        """
+        Run espeak and return (pcm, sample_rate) without playing anything.
+        """
+        wav = subprocess.run(["espeak", "--stdout", "-a", str(self.volume), text],
+                             stdout=subprocess.PIPE, check=True).stdout
+        return read_wav_bytes(wav)
+
+    def render(self, text, cache=True):
+        if not cache:
+            return self.synthesize(text)
+
+        key = f"{self.volume}:{text}"
+        with self._cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        audio = self.load_from_disk(key)
+        if audio is None:
+            audio = self.synthesize(text)
+            self.save_to_disk(key, audio)
+        with self._cache_lock:
+            self.store(key, audio)
+        return audio
+
+    def store(self, key, audio):
+        # two threads can synthesize the same text, the second replaces the first's entry
+        previous = self.cache.pop(key, None)
+        if previous is not None:
+            self.cached_bytes -= len(previous[0])
+        self.cache[key] = audio
+        self.cached_bytes += len(audio[0])
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, (pcm, _) = self.cache.popitem(last=False)
+            self.cached_bytes -= len(pcm)
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".wav")
+
+    def load_from_disk(self, key):
+        if not self.cache_dir or not os.path.exists(self.disk_path(key)):
+            return None
+        with open(self.disk_path(key), "rb") as f:
+            return read_wav_bytes(f.read())
+
+    def save_to_disk(self, key, audio):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        pcm, rate = audio
+        with wave.open(self.disk_path(key), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(rate)
+            f.writeframes(pcm)
+
+    def play(self, pcm, rate, cancelled=None):
+        with self._lock:
+            if self._stream is None or self._stream_rate != rate:
+                import pyaudio
+                if self._pyaudio is None:
+                    self._pyaudio = pyaudio.PyAudio()
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = self._pyaudio.open(format=pyaudio.paInt16, channels=1,
+                                                  rate=rate, output=True)
+                self._stream_rate = rate
+            # write in ~100ms blocks so playback can be interrupted part way through
+            block = rate // 10 * 2
+            tracer.mark("tts_first_audio")
+            for start in range(0, len(pcm), block):
+                if self.stopped(cancelled):
+                    return
+                self._stream.write(pcm[start:start + block])
+
+    def interrupt(self):
+        """
+        Stop whatever is playing, e.g. because the user started talking over the assistant.
+        """
+        self._interrupted.set()
+
+    def stopped(self, cancelled=None):
+        """
+        True if playback should stop: interrupted, or `cancelled` (the turn's threading.Event) is set.
+        """
+        return self._interrupted.is_set() or (cancelled is not None and cancelled.is_set())
+
+    def speak(self, text, cache=True, cancelled=None):
+        if not text.strip() or (cancelled is not None and cancelled.is_set()):
+            return
+        self._interrupted.clear()
+        try:
+            self.play(*self.render(text, cache=cache), cancelled=cancelled)
+        except Exception as e:
+            print(f"Audio output failed, using espeak directly: {e}")
+            subprocess.run(["espeak", "-a", str(self.volume), text])
+
+    def prewarm(self, phrases=FIXED_PHRASES, background=True):
+        """
+        Render phrases ahead of time so their first use is instant.
+        """
+        def _render():
+            for phrase in phrases:
+                try:
+                    self.render(phrase)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f"Could not prewarm '{phrase}': {e}")
+
+        if background:
+            threading.Thread(target=_render, daemon=True).start()
+        else:
+            _render()
+
+
+def read_wav_bytes(wav):
+    """
+    Return (pcm, sample_rate) from in-memory 16-bit mono WAV bytes.
+    """
+    with wave.open(io.BytesIO(wav), "rb") as f:
+        return f.readframes(f.getnframes()), f.getframerate()
+
+
+tts_engine = TTSEngine(volume=config['SPEECH_VOLUME'],
+                       cache_bytes=config['TTS_CACHE_MB'] * 1024 * 1024,
+                       cache_dir=config['TTS_CACHE_DIR'])
+
+
+def speak(text, cache=True, cancelled=None):
+    tts_engine.speak(text, cache=cache, cancelled=cancelled)
+    reply_heartbeat.beat()
+
+
+class SpeechQueue:
+    """
+    Speaks text on a worker thread so the caller can keep generating.
+    The queue is bounded: a producer that gets too far ahead of the speaker blocks,
+    so a turn takes roughly max(generation, speech) instead of the sum of the two.
+    """
+
+    def __init__(self, maxsize=3):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def say(self, text, cancelled=None):
+        if not text.strip():
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        # spoken in the caller's context, so the worker's playback is traced in the caller's turn
+        self.queue.put((contextvars.copy_context(), text, cancelled))
+
+    def wait(self):
+        """
+        Block until everything queued has been spoken.
+        """
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            context, text, cancelled = self.queue.get()
+            try:
+                # streamed LLM sentences are rarely repeated, so keep them out of the phrase cache
+                context.run(speak, text, cache=False, cancelled=cancelled)
+            finally:
+                self.queue.task_done()
+
+
+speech_queue = SpeechQueue(maxsize=config['SPEECH_QUEUE_SIZE'])
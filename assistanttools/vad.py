@@ -0,0 +1,191 @@
+import importlib.util
+import math
+from collections import deque
+import numpy as np
+from assistanttools.utils import SAMPLE_RATE
+from assistanttools.wake_word import frame_energy
+
+
+class EnergyVad:
+    """
+    A frame is speech if its RMS energy is over a fixed threshold. The old behaviour.
+    """
+
+    def __init__(self, energy_threshold=0.01):
+        self.energy_threshold = energy_threshold
+
+    def is_speech(self, frame):
+        return frame_energy(frame) > self.energy_threshold
+
+
+class SpectralVad:
+    """
+    Energy plus a small spectral check, for when webrtcvad isn't installed.
+
+    A frame is speech if it is well above the running noise floor and most of its energy is in the
+    speech band. Fan and wind noise is mostly low frequency or broadband, so it fails the band check
+    even when it is loud, and the noise floor follows it when it gets louder.
+    """
+
+    def __init__(self, energy_threshold=0.01, sample_rate=SAMPLE_RATE, band=(300, 3400),
+                 band_ratio=0.5, noise_ratio=3.0, adaptation=0.05):
+        self.energy_threshold = energy_threshold
+        self.sample_rate = sample_rate
+        self.band = band
+        self.band_ratio = band_ratio
+        self.noise_ratio = noise_ratio
+        self.adaptation = adaptation
+        self.noise_floor = energy_threshold / noise_ratio
+        self._windows = {}
+
+    def band_fraction(self, frame):
+        if len(frame) not in self._windows:
+            frequencies = np.fft.rfftfreq(len(frame), 1 / self.sample_rate)
+            self._windows[len(frame)] = (np.hanning(len(frame)).astype(np.float32),
+                                         (frequencies >= self.band[0]) & (frequencies <= self.band[1]))
+        window, in_band = self._windows[len(frame)]
+        power = np.abs(np.fft.rfft(frame * window)) ** 2
+        return float(power[in_band].sum() / (power.sum() + 1e-12))
+
+    def is_speech(self, frame):
+        energy = frame_energy(frame)
+        speech = (energy > max(self.energy_threshold, self.noise_floor * self.noise_ratio)
+                  and self.band_fraction(frame) > self.band_ratio)
+        if not speech:
+            self.noise_floor += self.adaptation * (energy - self.noise_floor)
+        return speech
+
+
+class WebRtcVad:
+    """
+    Google's WebRTC voice activity detector. Needs 10, 20 or 30 ms frames of 16-bit PCM.
+    """
+
+    def __init__(self, aggressiveness=2, sample_rate=SAMPLE_RATE):
+        import webrtcvad
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.sample_rate = sample_rate
+
+    def is_speech(self, frame):
+        pcm = (np.clip(frame, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+        return self.vad.is_speech(pcm, self.sample_rate)
+
+
+def create_vad(backend="auto", energy_threshold=0.01, aggressiveness=2):
+    """
+    "auto" uses webrtcvad if it is installed and the spectral VAD otherwise.
+    """
+    if backend == "auto":
+        backend = "webrtc" if importlib.util.find_spec("webrtcvad") is not None else "spectral"
+    if backend == "webrtc":
+        return WebRtcVad(aggressiveness)
+    if backend == "spectral":
+        return SpectralVad(energy_threshold)
+    if backend == "energy":
+        return EnergyVad(energy_threshold)
+    raise ValueError(f"Unknown VAD backend {backend}")
+
+
+class Endpointer:
+    """
+    Cuts utterances out of a stream of audio using a frame level VAD.
+
+    Audio is split into fixed 30 ms frames. An utterance starts after `onset_seconds` of
+    consecutive speech, keeping `pre_roll_seconds` from before it, and ends after `hangover_seconds`
+    without speech or at `max_seconds`. Trailing silence is trimmed to `tail_seconds`, and a segment
+    with less than `min_speech_seconds` of speech (a click, a cough, a gust of fan noise) is dropped
+    instead of being sent to ASR.
+
+    If `stream` is given (e.g. a StreamingTranscriber), the utterance's audio is pushed to it as it
+    is captured, and it is reset when a segment is dropped.
+    """
+
+    def __init__(self, vad, sample_rate=SAMPLE_RATE, frame_seconds=0.03, onset_seconds=0.09,
+                 hangover_seconds=0.5, pre_roll_seconds=0.3, tail_seconds=0.15,
+                 min_speech_seconds=0.2, max_seconds=7, stream=None):
+        self.vad = vad
+        self.stream = stream
+        self.frame_size = int(frame_seconds * sample_rate)
+        self.onset_frames = max(1, math.ceil(onset_seconds / frame_seconds))
+        self.hangover_frames = max(1, math.ceil(hangover_seconds / frame_seconds))
+        self.tail_frames = math.ceil(tail_seconds / frame_seconds)
+        self.min_speech_frames = math.ceil(min_speech_seconds / frame_seconds)
+        self.max_frames = math.ceil(max_seconds / frame_seconds)
+        self.pre_roll = deque(maxlen=math.ceil(pre_roll_seconds / frame_seconds) + self.onset_frames)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        self.triggered = False
+        self.frames = []
+        self.run = 0
+        self.voiced = 0
+        self.silence = 0
+
+    def start_with(self, audio):
+        """
+        Start an utterance with audio already known to be speech, e.g. a barge-in.
+        """
+        self.triggered = True
+        self.frames = [audio[i:i + self.frame_size] for i in range(0, len(audio), self.frame_size)]
+        self.voiced = len(self.frames)
+        if self.stream is not None:
+            self.stream.push(audio)
+
+    def push(self, audio):
+        """
+        Feed audio of any length. Returns a finished utterance, or None.
+        """
+        audio = np.concatenate((self.pending, audio)) if len(self.pending) else audio
+        end = len(audio) - len(audio) % self.frame_size
+        self.pending = audio[end:]
+        for start in range(0, end, self.frame_size):
+            utterance = self.process(audio[start:start + self.frame_size])
+            if utterance is not None:
+                # anything after the end of the utterance belongs to the next one
+                self.pending = audio[start + self.frame_size:]
+                return utterance
+        return None
+
+    def process(self, frame):
+        speech = self.vad.is_speech(frame)
+        if not self.triggered:
+            self.pre_roll.append(frame)
+            self.run = self.run + 1 if speech else 0
+            if self.run >= self.onset_frames:
+                self.triggered = True
+                self.frames = list(self.pre_roll)
+                self.voiced = self.run
+                self.pre_roll.clear()
+                if self.stream is not None:
+                    self.stream.push(np.concatenate(self.frames))
+            return None
+
+        self.frames.append(frame)
+        if self.stream is not None:
+            self.stream.push(frame)
+        if speech:
+            self.voiced += 1
+            self.silence = 0
+        else:
+            self.silence += 1
+        if self.silence >= self.hangover_frames or len(self.frames) >= self.max_frames:
+            return self.finish()
+        return None
+
+    def finish(self):
+        """
+        Close the current utterance. Returns None if there wasn't enough speech in it.
+        """
+        if not self.triggered:
+            return None
+        frames = self.frames[:len(self.frames) - max(0, self.silence - self.tail_frames)]
+        voiced = self.voiced
+        self.reset()
+        if voiced < self.min_speech_frames:
+            self.dropped += 1
+            if self.stream is not None:
+                self.stream.reset()
+            return None
+        return np.concatenate(frames)
@@ -0,0 +1,93 @@
+import threading
+import time
+import numpy as np
+from config import config
+
+
+def frame_signature(image, size=(32, 24)):
+    """
+    A tiny grayscale copy of the frame, cheap to compare and blind to sensor noise.
+    """
+    from PIL import Image
+    return np.asarray(image.convert("L").resize(size, Image.BOX), dtype=np.float32)
+
+
+def frame_difference(a, b, pixel_threshold=25):
+    """
+    (mean absolute difference on a 0-255 scale, fraction of pixels that changed by more than `pixel_threshold`)
+    """
+    difference = np.abs(a - b)
+    return float(difference.mean()), float((difference > pixel_threshold).mean())
+
+
+class VisionCache:
+    """
+    The last vision result for each model, reused while the camera keeps seeing the same scene.
+
+    Frames are compared as 32x24 grayscale thumbnails. The scene counts as unchanged if the mean
+    difference is at most `max_difference` (catches lighting and camera movement) and no more than
+    `max_changed` of the pixels changed by more than `pixel_threshold` (catches someone walking
+    into a corner of the frame). Results older than `max_age` seconds are never reused.
+
+    `stats` counts hits and why each miss happened, and `differences` keeps the last comparisons,
+    to tune the thresholds against what the camera actually sees.
+    """
+
+    def __init__(self, max_age=30, max_difference=6., max_changed=0.05, pixel_threshold=25, enabled=True):
+        self.max_age = max_age
+        self.max_difference = max_difference
+        self.max_changed = max_changed
+        self.pixel_threshold = pixel_threshold
+        self.enabled = enabled
+        self.entries = {}
+        self.differences = []
+        self.stats = {'hits': 0, 'changed': 0, 'expired': 0, 'empty': 0, 'stores': 0}
+        self._lock = threading.Lock()
+
+    def get(self, key, image):
+        """
+        The cached result for `key` if `image` shows the same scene, otherwise None.
+        Returns the frame's signature too, to hand to `put` after a miss.
+        """
+        if not self.enabled:
+            return None, None
+        signature = frame_signature(image)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['empty'] += 1
+                return None, signature
+            if time.time() - entry['created'] > self.max_age:
+                del self.entries[key]
+                self.stats['expired'] += 1
+                return None, signature
+            mean, changed = frame_difference(signature, entry['signature'], self.pixel_threshold)
+            self.differences = (self.differences + [(round(mean, 2), round(changed, 3))])[-20:]
+            if mean > self.max_difference or changed > self.max_changed:
+                self.stats['changed'] += 1
+                return None, signature
+            self.stats['hits'] += 1
+            print(f"The scene hasn't changed ({mean:.1f} mean difference, {changed:.0%} changed), "
+                  f"reusing the result from {time.time() - entry['created']:.0f}s ago.")
+            return entry['result'], signature
+
+    def put(self, key, signature, result):
+        if not self.enabled or signature is None or not result.strip():
+            return
+        with self._lock:
+            self.entries[key] = {'signature': signature, 'result': result, 'created': time.time()}
+            self.stats['stores'] += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def hit_rate(self):
+        total = sum(self.stats[x] for x in ('hits', 'changed', 'expired', 'empty'))
+        return self.stats['hits'] / total if total else 0.
+
+
+vision_cache = VisionCache(max_age=config['VISION_CACHE_MAX_AGE'],
+                           max_difference=config['VISION_CACHE_MAX_DIFFERENCE'],
+                           max_changed=config['VISION_CACHE_MAX_CHANGED'],
+                           enabled=config['VISION_CACHE'])
@@ -0,0 +1,184 @@
+import re
+from collections import deque
+import numpy as np
+from assistanttools.utils import SAMPLE_RATE
+
+
+class AudioRingBuffer:
+    """
+    Fixed-size rolling buffer of the most recent float32 samples.
+    Writing never allocates, so it can sit on the capture path forever.
+    """
+
+    def __init__(self, seconds, sample_rate=SAMPLE_RATE):
+        self.size = int(seconds * sample_rate)
+        self.sample_rate = sample_rate
+        self.buffer = np.zeros(self.size, dtype=np.float32)
+        self.position = 0
+        self.filled = 0
+
+    def write(self, frame):
+        frame = frame[-self.size:]
+        end = self.position + len(frame)
+        if end <= self.size:
+            self.buffer[self.position:end] = frame
+        else:
+            split = self.size - self.position
+            self.buffer[self.position:] = frame[:split]
+            self.buffer[:end - self.size] = frame[split:]
+        self.position = end % self.size
+        self.filled = min(self.size, self.filled + len(frame))
+
+    def read(self, samples=None):
+        """
+        Return the last `samples` samples in chronological order.
+        """
+        samples = self.filled if samples is None else min(samples, self.filled)
+        start = (self.position - samples) % self.size
+        if start + samples <= self.size:
+            return self.buffer[start:start + samples].copy()
+        return np.concatenate((self.buffer[start:], self.buffer[:self.position]))
+
+    def clear(self):
+        self.position = 0
+        self.filled = 0
+
+
+def frame_energy(frame):
+    """
+    Root mean square energy of a float32 frame.
+    """
+    if len(frame) == 0:
+        return 0.
+    return float(np.sqrt(np.mean(np.square(frame))))
+
+
+def contains_wake_word(transcription, wake_word):
+    transcription = transcription.lower()
+    return any(x in transcription for x in wake_word)
+
+
+def strip_wake_word(transcription, wake_word, lead_words=4):
+    """
+    Return whatever was said after the wake phrase, e.g. "Johnny five, what's five plus five?" -> "what's five plus five?"
+    Only the first wake phrase starting within the first `lead_words` words is stripped (with any wake words
+    right after it), so a command that repeats a wake word keeps it.
+    """
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(x) for x in wake_word) + r")\b", re.IGNORECASE)
+    words = [match.end() for match in re.finditer(r"\S+", transcription)]
+    lead_end = words[min(lead_words, len(words)) - 1] if words else 0
+    end = 0
+    for match in pattern.finditer(transcription):
+        if end == 0 and match.start() >= lead_end:
+            break
+        if end and not re.fullmatch(r"[\s,.!?]*", transcription[end:match.start()]):
+            break
+        end = match.end()
+    return re.sub(r"^[\s,.!?]+", "", transcription[end:])
+
+
+class StreamingWakeWordDetector:
+    """
+    Continuous wake word detection over a stream of 16 kHz float32 frames.
+
+    Frames are kept in a ring buffer. An energy gate finds bursts of sound, and only then
+    is a short window around the burst transcribed to look for the wake word. Once the wake word
+    is confirmed, capture continues until silence, and the whole utterance (including pre-roll)
+    is returned so the start of the command isn't lost.
+
+    The gate adapts to the room: the noise floor is a low percentile of the last `noise_frames`
+    frame energies, so steady fan noise raises the threshold while speech, which has pauses, doesn't.
+    """
+
+    IDLE, VOICED, CAPTURING = range(3)
+
+    def __init__(self,
+                 transcribe,
+                 wake_word,
+                 sample_rate=SAMPLE_RATE,
+                 window_seconds=2.0,
+                 pre_roll_seconds=1.0,
+                 energy_threshold=0.01,
+                 noise_ratio=3.0,
+                 hangover_seconds=0.3,
+                 silence_seconds=0.8,
+                 max_command_seconds=7,
+                 noise_frames=200,
+                 noise_percentile=20):
+        self.transcribe = transcribe
+        self.wake_word = wake_word
+        self.sample_rate = sample_rate
+        self.window = int(window_seconds * sample_rate)
+        self.pre_roll = int(pre_roll_seconds * sample_rate)
+        self.energy_threshold = energy_threshold
+        self.noise_ratio = noise_ratio
+        self.hangover = int(hangover_seconds * sample_rate)
+        self.silence = int(silence_seconds * sample_rate)
+        self.max_command = int(max_command_seconds * sample_rate)
+        self.ring = AudioRingBuffer(window_seconds + pre_roll_seconds +
+                                    max_command_seconds, sample_rate)
+        self.noise_floor = energy_threshold / noise_ratio
+        self.noise_percentile = noise_percentile
+        self.energies = deque(maxlen=noise_frames)
+        self.reset()
+
+    def reset(self):
+        self.state = self.IDLE
+        self.voiced_samples = 0
+        self.quiet_samples = 0
+        self.captured_samples = 0
+
+    @property
+    def threshold(self):
+        return max(self.energy_threshold, self.noise_floor * self.noise_ratio)
+
+    def is_voiced(self, frame):
+        energy = frame_energy(frame)
+        self.energies.append(energy)
+        # track the ambient level (fan noise etc) once there are enough frames to tell it from a burst
+        if len(self.energies) >= self.energies.maxlen // 10 and len(self.energies) % 10 == 0:
+            self.noise_floor = float(np.percentile(self.energies, self.noise_percentile))
+        return energy > self.threshold
+
+    def process(self, frame):
+        """
+        Feed one frame. Returns the captured utterance once the wake word is confirmed and the speaker
+        has gone quiet, otherwise None.
+        """
+        self.ring.write(frame)
+        voiced = self.is_voiced(frame)
+        self.quiet_samples = 0 if voiced else self.quiet_samples + len(frame)
+
+        if self.state == self.IDLE:
+            if voiced:
+                self.state = self.VOICED
+                self.voiced_samples = len(frame)
+            return None
+
+        if self.state == self.VOICED:
+            self.voiced_samples += len(frame)
+            burst_ended = self.quiet_samples >= self.hangover
+            if burst_ended or self.voiced_samples >= self.window:
+                if self.check_window():
+                    self.state = self.CAPTURING
+                    self.captured_samples = self.voiced_samples + self.pre_roll
+                    if burst_ended and self.quiet_samples >= self.silence:
+                        return self.finish()
+                else:
+                    self.state = self.IDLE
+            return None
+
+        self.captured_samples += len(frame)
+        if self.quiet_samples >= self.silence or self.captured_samples >= self.max_command:
+            return self.finish()
+        return None
+
+    def check_window(self):
+        window = self.ring.read(min(self.window, self.voiced_samples + self.pre_roll))
+        transcription = self.transcribe(window)
+        return contains_wake_word(transcription, self.wake_word)
+
+    def finish(self):
+        utterance = self.ring.read(self.captured_samples)
+        self.reset()
+        return utterance
@@ -0,0 +1,81 @@
+import threading
+import time
+
+
+class ModelWarmup:
+    """
+    Loads an Ollama model in the background and keeps it resident.
+
+    Every request made through this class (and every chat call that passes `keep_alive`) resets
+    Ollama's unload timer. After a quiet period, `rewarm` reloads the model proactively, e.g. as
+    soon as the wake word fires, so the load overlaps with capturing the command.
+    """
+
+    def __init__(self, model_name, keep_alive="30m", idle_seconds=60, options=None):
+        self.model_name = model_name
+        self.keep_alive = keep_alive
+        # must match the chat requests' options, or the next chat loads the model again
+        self.options = options or {}
+        self.idle_seconds = idle_seconds
+        self.last_used = 0.
+        self.loaded = threading.Event()
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def warm(self, background=True):
+        """
+        Ask Ollama to load the model. An empty prompt loads it without generating anything.
+        In the foreground this waits for a load that is already running rather than starting another,
+        and raises if the load failed.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.loaded.clear()
+                self.error = None
+                self._thread = threading.Thread(target=self._load, daemon=True)
+                self._thread.start()
+            thread = self._thread
+        if not background:
+            thread.join()
+            if self.error is not None:
+                raise self.error
+        return self
+
+    def _load(self):
+        start = time.time()
+        try:
+            # imported here so the import happens on this background thread, not during startup
+            import ollama
+            ollama.generate(model=self.model_name, prompt="",
+                            keep_alive=self.keep_alive, options=self.options)
+        except Exception as e:
+            print(f"Could not preload {self.model_name}: {e}")
+            # left for warm() to raise; `loaded` stays clear
+            self.error = e
+            return
+        print(f"Model {self.model_name} loaded in {time.time() - start:.1f}s.")
+        self.touch()
+        self.loaded.set()
+
+    def rewarm(self):
+        """
+        Reload in the background if the model has been idle long enough that Ollama may have dropped it.
+        """
+        if time.time() - self.last_used > self.idle_seconds:
+            self.warm(background=True)
+
+    def unload(self):
+        """
+        Ask Ollama to drop the model now (keep_alive=0), e.g. to make room for another model.
+        """
+        import ollama
+        ollama.generate(model=self.model_name, prompt="", keep_alive=0)
+        self.loaded.clear()
+        self.last_used = 0.
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def wait(self, timeout=None):
+        return self.loaded.wait(timeout)
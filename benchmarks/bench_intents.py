@@ -0,0 +1,62 @@
+"""
+Compare the intent router with the old substring checks on a corpus of recorded transcripts.
+
+    python -m benchmarks.bench_intents [benchmarks/transcripts.tsv] [iterations]
+"""
+import re
+import sys
+import time
+from assistanttools.intents import intent_router
+
+
+def legacy_route(transcription):
+    """
+    The if/elif chain the LLM path and main.py used before the router.
+    """
+    if transcription.strip().lower() == "you" or transcription.strip() == "." or transcription.strip() == "":
+        return 'ignore'
+    if re.match(r"\(.*\)", transcription):
+        return 'ignore'
+    if any([x in transcription.lower() for x in ["stop", "exit", "quit"]]):
+        return 'exit'
+    if 'weather' in transcription:
+        return 'weather'
+    if any([x in transcription.lower() for x in ["photo", "picture", "image", "snap", "shoot"]]):
+        return 'vision'
+    if "news" in transcription:
+        return 'news'
+    return 'chat'
+
+
+def load_corpus(path):
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#") or not line.strip("\n"):
+                continue
+            expected, _, transcription = line.rstrip("\n").partition("\t")
+            corpus.append((expected, transcription))
+    return corpus
+
+
+def evaluate(name, route, corpus, iterations):
+    mistakes = [(expected, route(text), text) for expected, text in corpus if route(text) != expected]
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for _, text in corpus:
+            route(text)
+    per_call = (time.perf_counter() - start) / (iterations * len(corpus))
+
+    print(f"{name}: {len(corpus) - len(mistakes)}/{len(corpus)} correct, {per_call * 1e6:.1f} us per call")
+    for expected, got, text in mistakes:
+        print(f"    expected {expected:<7} got {got:<7} {text!r}")
+    return len(mistakes), per_call
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "benchmarks/transcripts.tsv"
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    corpus = load_corpus(path)
+    evaluate("substring checks", legacy_route, corpus, iterations)
+    evaluate("intent router", lambda text: intent_router.route(text).name, corpus, iterations)
@@ -0,0 +1,358 @@
+"""
+Replay recorded audio through the real WakeWordListener and ActionEngine, with the microphone,
+camera, espeak, Ollama and the HTTP providers replaced by the local fakes in benchmarks/fakes.py,
+and report latency per stage from the turn traces.
+
+    python -m benchmarks.bench_pipeline [benchmarks/session.tsv | fixtures/] [--repeat 3]
+        [--asr fake,faster-whisper,whisper.cpp] [--vision fake,detr,moondream]
+        [--latency-scale 0.1] [--save results.json] [--baseline results.json --threshold 0.2]
+        [--llm ollama] [--cpu-threads asr=4,llm=3,vision=4] [--cpu-affinity asr=0+1]
+
+Every combination of --asr and --vision is run. A real ASR backend is timed on each utterance but
+the scripted transcript is still used, so every run has the same conversation. With --baseline,
+the exit code is 1 if any stage is slower than the baseline by more than --threshold.
+To see what a CPU budget does, save a run with real backends and compare a run with a different
+--cpu-threads against it as the baseline.
+The wake word listener runs in phrase mode, so the replay advances one utterance per turn.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from config import config
+
+# read when the pipeline modules are imported
+config['WHISPER_CPP_SERVER'] = False
+config['CAMERA_BACKEND'] = 'file'
+config['VISION_MODEL'] = config['VISION_MODEL'] or 'detr'
+config['RAG_CACHE_DIR'] = None
+config['TTS_CACHE_DIR'] = None
+config['RESPONSE_CACHE_PATH'] = None
+
+import ollama
+import main
+from assistanttools import actions, utils
+from assistanttools.context import ConversationContext
+from assistanttools.cpu_budget import STAGES, cpu_budget
+from assistanttools.generate_detr import detr_worker
+from assistanttools.model_registry import model_registry
+from assistanttools.tracing import load_records, print_summary, summarize, tracer
+from assistanttools.utils import read_wav
+from assistanttools.vad import create_vad
+from benchmarks.fakes import (FAKE_DATA, FakeOllama, FakeTranscriber, FakeTTSEngine, ReplayMicrophone,
+                              ScriptFinished, Utterance, fake_detect, fake_fetch)
+
+
+# a real backend that can't be loaded here is skipped rather than failing the whole run
+BACKEND_ERRORS = (ImportError, KeyError, OSError, RuntimeError, TimeoutError)
+
+
+class BenchActionEngine(main.ActionEngine):
+    def notify(self):
+        pass
+
+
+def load_script(path):
+    """
+    Utterances from a TSV of `audio <TAB> transcript`, or from a directory holding a session.tsv
+    or WAV files with the transcript in a .txt file of the same name.
+    """
+    if os.path.isdir(path):
+        if not os.path.exists(os.path.join(path, "session.tsv")):
+            utterances = []
+            for wav in sorted(glob.glob(os.path.join(path, "*.wav"))):
+                with open(os.path.splitext(wav)[0] + ".txt") as f:
+                    utterances.append(Utterance(read_wav(wav), f.read().strip(), wav))
+            return utterances
+        path = os.path.join(path, "session.tsv")
+
+    audio = {}
+    utterances = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            wav, _, transcript = line.rstrip("\n").partition("\t")
+            if not os.path.exists(wav):
+                wav = os.path.join(os.path.dirname(path), wav)
+            if wav not in audio:
+                audio[wav] = read_wav(wav)
+            utterances.append(Utterance(audio[wav], transcript, wav))
+    return utterances
+
+
+def load_asr(name):
+    """
+    A transcribe(speech) function for a real backend, or None for the fake.
+    """
+    if name == 'fake':
+        return None
+    if name == 'faster-whisper':
+        from faster_whisper import WhisperModel
+        model = WhisperModel("base.en", cpu_threads=cpu_budget.threads("asr", base=True) or 0)
+
+        def transcribe(speech):
+            segments, _ = model.transcribe(speech)
+            return " ".join([x.text for x in segments]).strip()
+        return transcribe
+    if name == 'whisper.cpp':
+        from assistanttools.transcribe_gguf import WhisperCppServer
+        server = WhisperCppServer(whisper_cpp_path=config["WHISPER_CPP_PATH"],
+                                  model_path=config["WHISPER_MODEL_PATH"],
+                                  port=config["WHISPER_CPP_PORT"],
+                                  threads=cpu_budget.threads("asr", base=True),
+                                  preexec_fn=cpu_budget.preexec("asr"))
+        server.start(watch=False)
+        return server.transcribe
+    raise ValueError(f"Unknown ASR backend {name}")
+
+
+def load_vision(name, args):
+    """
+    Set up a vision backend and return the VISION_MODEL it runs under.
+    """
+    detr_worker.__dict__.pop('detect', None)
+    detr_worker.__dict__.pop('load', None)
+    if name == 'fake':
+        # the registry still loads 'detr' before each detection, so make that free too
+        detr_worker.load = lambda: None
+        detr_worker.detect = fake_detect(args.vision_latency * args.latency_scale)
+        return 'detr'
+    if name == 'detr':
+        model_registry.warm('detr', background=False)
+        return 'detr'
+    if name == 'moondream':
+        if actions.llava_server is None:
+            actions.llava_server = actions.register_llava_server(
+                actions.LlavaServer(llama_cpp_path=config["LLAMA_CPP_PATH"],
+                                    model_path=config["MOONDREAM_MODEL_PATH"],
+                                    mmproj_path=config["MOONDREAM_MMPROJ_PATH"],
+                                    port=config["LLAVA_SERVER_PORT"],
+                                    threads=cpu_budget.threads("vision", base=True),
+                                    preexec_fn=cpu_budget.preexec("vision")))
+        model_registry.warm('moondream', background=False)
+        return 'moondream'
+    raise ValueError(f"Unknown vision backend {name}")
+
+
+def run_session(name, utterances, asr, vision_model, args, trace_dir):
+    scale = args.latency_scale
+    config['VISION_MODEL'] = vision_model
+    if args.llm == 'fake':
+        FakeOllama(first_token_latency=args.llm_first_token * scale,
+                   token_latency=args.llm_token * scale).install(ollama)
+
+    tts = FakeTTSEngine(latency=args.tts_latency * scale, speed=args.playback_speed)
+    utils.tts_engine = main.tts_engine = tts
+    for provider in actions.providers.values():
+        provider.fetch = fake_fetch(FAKE_DATA[provider.name], args.http_latency * scale)
+        provider.data = None
+        provider.fetched_at = 0.
+        provider.ttl = args.rag_ttl
+    actions.response_cache.enabled = args.response_cache
+    actions.response_cache.clear()
+    actions.response_cache.stats = dict.fromkeys(actions.response_cache.stats, 0)
+    actions.vision_cache.enabled = args.vision_cache
+    actions.vision_cache.clear()
+    actions.vision_cache.stats = dict.fromkeys(actions.vision_cache.stats, 0)
+
+    microphone = ReplayMicrophone(utterances, speed=args.speed,
+                                  vad=create_vad(args.vad, energy_threshold=config["ENERGY_THRESHOLD"]),
+                                  min_speech_seconds=args.min_speech_seconds).start()
+    transcriber = FakeTranscriber(microphone, latency=args.asr_latency * scale,
+                                  real_time_factor=args.asr_rtf * scale, backend=asr)
+    main.transcribe_audio = transcriber
+
+    engine = BenchActionEngine(sounds_path=config["SOUNDS_PATH"],
+                               whisper_cpp_path=config["WHISPER_CPP_PATH"],
+                               whisper_model_path=config["WHISPER_MODEL_PATH"],
+                               ollama_model=config["LOCAL_MODEL"],
+                               message_history=ConversationContext(config['SYSTEM_PROMPT'],
+                                                                   token_budget=config['CONTEXT_TOKEN_BUDGET'],
+                                                                   max_messages=config['MAX_HISTORY_MESSAGES']),
+                               store_conversations=False,
+                               microphone=microphone,
+                               vision_model=vision_model)
+    listener = main.WakeWordListener(timeout=config["TIMEOUT"],
+                                     phrase_time_limit=config["PHRASE_TIME_LIMIT"],
+                                     sounds_path=config["SOUNDS_PATH"],
+                                     wake_word=config["WAKE_WORD"],
+                                     action_engine=engine,
+                                     whisper_cpp_path=config["WHISPER_CPP_PATH"],
+                                     whisper_model_path=config["WHISPER_MODEL_PATH"],
+                                     microphone=microphone,
+                                     streaming=False)
+
+    tracer.enabled = True
+    tracer.path = os.path.join(trace_dir, f"{name.replace('/', '-')}.jsonl")
+    tracer.max_bytes = 1024 * 1024 * 1024
+    start = time.perf_counter()
+    try:
+        asyncio.run(listener.listen_for_wake_word())
+    except ScriptFinished:
+        pass
+    wall_seconds = time.perf_counter() - start
+
+    records = load_records(tracer.path, backup_count=0)
+    return {
+        'turns': len(records),
+        'wall_seconds': wall_seconds,
+        'audio_seconds': microphone.played_seconds,
+        'turns_per_minute': 60 * len(records) / wall_seconds,
+        'real_time_factor': wall_seconds / microphone.played_seconds,
+        'transcriptions': transcriber.calls,
+        'asr_mismatches': transcriber.mismatches,
+        'response_cache': dict(actions.response_cache.stats),
+        'vision_cache': dict(actions.vision_cache.stats),
+        'cpu_threads': {stage: cpu_budget.threads(stage, base=True) for stage in STAGES},
+        'stages': summarize(records),
+    }
+
+
+def print_result(name, result):
+    print(f"\n== {name}: {result['turns']} turns in {result['wall_seconds']:.2f}s, "
+          f"{result['turns_per_minute']:.1f} turns/min, {result['real_time_factor']:.2f}x real time")
+    print("   threads: " + ", ".join(f"{stage} {threads or 'all'}" for stage, threads in result['cpu_threads'].items()))
+    print_summary(result['stages'])
+    if result['response_cache']['hits'] or result['response_cache']['misses']:
+        print(f"    response cache: {result['response_cache']['hits']} hits, "
+              f"{result['response_cache']['misses']} misses")
+    vision = result.get('vision_cache', {})
+    if vision.get('hits') or vision.get('stores'):
+        print(f"    vision cache: {vision['hits']} hits, {vision['changed']} changed, "
+              f"{vision['expired']} expired, {vision['empty']} empty")
+    for expected, heard in result['asr_mismatches']:
+        print(f"    ASR heard {heard!r}, script says {expected!r}")
+
+
+def print_comparison(results, metric):
+    names = list(results)
+    stages = sorted({stage for result in results.values() for stage in result['stages']})
+    print(f"\n{metric} by backend (s)")
+    print(f"{'stage':<24}" + "".join(f"{name:>24}" for name in names))
+    for stage in stages:
+        row = [results[name]['stages'].get(stage, {}).get(metric) for name in names]
+        print(f"{stage:<24}" + "".join(f"{'-' if x is None else format(x, '.3f'):>24}" for x in row))
+
+
+def find_regressions(results, baseline, threshold, metric, min_delta=0.005):
+    """
+    Stages slower than the baseline by more than `threshold` (a fraction), ignoring differences
+    under `min_delta` seconds so tiny stages don't fail on noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage, stats in result['stages'].items():
+            before = baseline[name]['stages'].get(stage)
+            if before is None:
+                continue
+            if stats[metric] > before[metric] * (1 + threshold) and stats[metric] - before[metric] > min_delta:
+                regressions.append((name, stage, before[metric], stats[metric]))
+    return regressions
+
+
+def split_stages(text):
+    """
+    "asr=2,vision=4" -> {'asr': '2', 'vision': '4'}
+    """
+    stages = {}
+    for item in text.split(","):
+        stage, _, value = item.partition("=")
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError(f"Unknown stage {stage}, expected one of {', '.join(STAGES)}")
+        stages[stage] = value
+    return stages
+
+
+def stage_threads(text):
+    return {stage: int(value) or None for stage, value in split_stages(text).items()}
+
+
+def stage_cores(text):
+    return {stage: [int(core) for core in value.split("+")] for stage, value in split_stages(text).items()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end latency benchmark.")
+    parser.add_argument("script", nargs="?", default="benchmarks/session.tsv",
+                        help="session TSV, or a directory of WAV fixtures")
+    parser.add_argument("--repeat", type=int, default=1, help="play the script this many times per run")
+    parser.add_argument("--asr", default="fake", help="comma separated: fake, faster-whisper, whisper.cpp")
+    parser.add_argument("--vision", default="fake", help="comma separated: fake, detr, moondream")
+    parser.add_argument("--speed", type=float, default=0., help="microphone replay speed, 0 for no waiting")
+    parser.add_argument("--vad", default="energy",
+                        help="energy, spectral, webrtc or auto. The last three need recorded speech as fixtures")
+    # sounds/heard.wav, used by the default script, is a 0.25s chime rather than speech
+    parser.add_argument("--min-speech-seconds", type=float, default=0.1)
+    parser.add_argument("--playback-speed", type=float, default=0., help="fake speech playback speed, 0 to skip")
+    parser.add_argument("--latency-scale", type=float, default=1., help="multiply every fake latency")
+    parser.add_argument("--asr-latency", type=float, default=0.3)
+    parser.add_argument("--asr-rtf", type=float, default=0.3, help="fake ASR seconds per second of audio")
+    parser.add_argument("--llm-first-token", type=float, default=0.8)
+    parser.add_argument("--llm-token", type=float, default=0.08)
+    parser.add_argument("--tts-latency", type=float, default=0.15)
+    parser.add_argument("--http-latency", type=float, default=0.3)
+    parser.add_argument("--vision-latency", type=float, default=1.5)
+    parser.add_argument("--rag-ttl", type=float, default=0., help="provider cache TTL, 0 fetches every time")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="answer repeated questions from the response cache, try with --repeat 2")
+    parser.add_argument("--vision-cache", action="store_true",
+                        help="reuse vision results while the scene is unchanged, try with --repeat 2")
+    parser.add_argument("--llm", default="fake", choices=["fake", "ollama"], help="ollama uses the real server")
+    parser.add_argument("--cpu-threads", type=stage_threads, default={},
+                        help="override CPU_THREADS, e.g. asr=2,llm=3 (0 for the backend's default)")
+    parser.add_argument("--cpu-affinity", type=stage_cores, default={},
+                        help="override CPU_AFFINITY, e.g. asr=0+1,vision=2+3")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--metric", default="p50", choices=["p50", "p95", "p99"])
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # before the backends load, they read their thread counts then
+    cpu_budget.base_threads.update(args.cpu_threads)
+    cpu_budget.affinity_cores.update(args.cpu_affinity)
+    utterances = load_script(args.script) * args.repeat
+
+    results = {}
+    with tempfile.TemporaryDirectory() as trace_dir:
+        for asr_name in args.asr.split(","):
+            try:
+                asr = load_asr(asr_name)
+            except BACKEND_ERRORS as e:
+                print(f"Skipping ASR backend {asr_name}: {e!r}")
+                continue
+            for vision_name in args.vision.split(","):
+                try:
+                    vision_model = load_vision(vision_name, args)
+                except BACKEND_ERRORS as e:
+                    print(f"Skipping vision backend {vision_name}: {e!r}")
+                    continue
+                name = f"{asr_name}/{vision_name}"
+                results[name] = run_session(name, utterances, asr, vision_model, args, trace_dir)
+                print_result(name, results[name])
+
+    if len(results) > 1:
+        print_comparison(results, args.metric)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold, args.metric)
+        for name, stage, before, after in regressions:
+            print(f"REGRESSION {name} {stage}: {args.metric} {before:.3f}s -> {after:.3f}s")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo stage regressed by more than {args.threshold:.0%}.")
@@ -0,0 +1,241 @@
+"""
+Deterministic stand-ins for the microphone, espeak, Ollama, DETR and the HTTP providers,
+so the pipeline can be benchmarked offline. Every fake takes its latency as arguments.
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+from assistanttools.microphone import MicrophoneStream
+from assistanttools.tracing import tracer
+from assistanttools.utils import SAMPLE_RATE, TTSEngine
+
+
+class ScriptFinished(Exception):
+    """
+    Raised by ReplayMicrophone once every utterance has been played, to end the run.
+    """
+
+
+class Utterance:
+    def __init__(self, audio, transcript, path=""):
+        self.audio = audio
+        self.transcript = transcript
+        self.path = path
+
+    @property
+    def seconds(self):
+        return len(self.audio) / SAMPLE_RATE
+
+
+class ReplayMicrophone(MicrophoneStream):
+    """
+    Plays a script of recorded utterances into the real MicrophoneStream logic.
+
+    Each listen() call on an empty stream queues the next utterance, padded with silence so the
+    real endpointing ends the phrase, which keeps the replay in step with the conversation.
+    With `speed` > 0 frames arrive at `speed` times real time, with 0 they are all available at once.
+    """
+
+    def __init__(self, utterances, speed=0., lead_seconds=0.3, tail_seconds=1.0,
+                 frame_size=1024, sample_rate=SAMPLE_RATE, **kwargs):
+        super().__init__(sample_rate=sample_rate, **kwargs)
+        self.utterances = deque(utterances)
+        self.speed = speed
+        self.lead_seconds = lead_seconds
+        self.tail_seconds = tail_seconds
+        self.frame_size = frame_size
+        self.current = None
+        self.played_seconds = 0.
+
+    def start(self):
+        self.frames = queue.Queue()
+        return self
+
+    def stop(self):
+        pass
+
+    def listen(self, *args, **kwargs):
+        if self.frames.empty():
+            if not self.utterances:
+                raise ScriptFinished()
+            self.current = self.utterances.popleft()
+            self.feed(self.current.audio)
+        return super().listen(*args, **kwargs)
+
+    def feed(self, audio):
+        audio = np.concatenate([np.zeros(int(self.lead_seconds * self.sample_rate), np.float32),
+                                audio,
+                                np.zeros(int(self.tail_seconds * self.sample_rate), np.float32)])
+        self.played_seconds += len(audio) / self.sample_rate
+        frames = [audio[i:i + self.frame_size] for i in range(0, len(audio), self.frame_size)]
+        if not self.speed:
+            for frame in frames:
+                self.frames.put(frame)
+            return
+
+        def _feed():
+            for frame in frames:
+                time.sleep(len(frame) / self.sample_rate / self.speed)
+                self.frames.put(frame)
+
+        threading.Thread(target=_feed, daemon=True).start()
+
+
+class FakeTranscriber:
+    """
+    Returns the scripted transcript of the utterance being played, after `latency` seconds plus
+    `real_time_factor` times the length of the audio. If `backend` is given (a real transcribe
+    function) it is run instead of sleeping, and its output is only compared with the script,
+    so a real model is timed without changing the course of the conversation.
+    """
+
+    def __init__(self, microphone, latency=0.05, real_time_factor=0.1, backend=None):
+        self.microphone = microphone
+        self.latency = latency
+        self.real_time_factor = real_time_factor
+        self.backend = backend
+        self.calls = 0
+        self.mismatches = []
+
+    def __call__(self, speech, file_path=None):
+        with tracer.span("transcription"):
+            self.calls += 1
+            expected = self.microphone.current.transcript
+            if self.backend is None:
+                time.sleep(self.latency + self.real_time_factor * len(speech) / SAMPLE_RATE)
+                return expected
+            heard = self.backend(speech)
+            if normalize(heard) != normalize(expected):
+                self.mismatches.append((expected, heard))
+            return expected
+
+
+def normalize(text):
+    return " ".join("".join(c for c in text.lower() if c.isalnum() or c.isspace()).split())
+
+
+class FakeTTSEngine(TTSEngine):
+    """
+    TTSEngine without espeak or a sound card. Rendering takes `latency` seconds and produces
+    silence as long as the phrase would take to say, playback sleeps for that long divided by `speed`
+    (0 skips it). The real cache and interrupt logic are kept.
+    """
+
+    def __init__(self, latency=0.02, speed=0., words_per_second=2.5, rate=22050, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.speed = speed
+        self.words_per_second = words_per_second
+        self.rate = rate
+        self.renders = 0
+
+    def synthesize(self, text):
+        self.renders += 1
+        time.sleep(self.latency)
+        seconds = len(text.split()) / self.words_per_second
+        return bytes(int(seconds * self.rate) * 2), self.rate
+
+    def play(self, pcm, rate, cancelled=None):
+        tracer.mark("tts_first_audio")
+        if not self.speed:
+            return
+        block = rate // 10 * 2
+        for start in range(0, len(pcm), block):
+            if self.stopped(cancelled):
+                return
+            time.sleep(len(pcm[start:start + block]) / 2 / rate / self.speed)
+
+
+class FakeOllama:
+    """
+    Stands in for the ollama module's chat, generate and AsyncClient. The reply is streamed a word
+    at a time, the first after `first_token_latency` seconds and the rest every `token_latency` seconds.
+    """
+
+    reply = ("I am a small robot living on a Raspberry Pi. "
+             "I heard you clearly and here is a short answer to your question. "
+             "Is there anything else you would like to know?")
+
+    def __init__(self, first_token_latency=0.3, token_latency=0.02, reply=None):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.reply = reply or self.reply
+        self.requests = 0
+
+    def tokens(self):
+        words = self.reply.split(" ")
+        return [w + " " for w in words[:-1]] + words[-1:]
+
+    def chat(self, model=None, messages=None, stream=False, **kwargs):
+        self.requests += 1
+
+        def _stream():
+            for i, token in enumerate(self.tokens()):
+                time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+                yield {'message': {'role': 'assistant', 'content': token}, 'done': False}
+
+        if stream:
+            return _stream()
+        return {'message': {'role': 'assistant', 'content': "".join(x['message']['content'] for x in _stream())}}
+
+    def generate(self, model=None, prompt="", **kwargs):
+        self.requests += 1
+        time.sleep(self.first_token_latency)
+        return {'response': ""}
+
+    def AsyncClient(self, *args, **kwargs):
+        return FakeAsyncClient(self)
+
+    def install(self, module):
+        """
+        Replace the ollama module's entry points with this fake.
+        """
+        module.chat = self.chat
+        module.generate = self.generate
+        module.AsyncClient = self.AsyncClient
+
+
+class FakeAsyncClient:
+    def __init__(self, ollama):
+        self.ollama = ollama
+
+    async def chat(self, model=None, messages=None, stream=False, **kwargs):
+        self.ollama.requests += 1
+
+        async def _stream():
+            for i, token in enumerate(self.ollama.tokens()):
+                await asyncio.sleep(self.ollama.first_token_latency if i == 0 else self.ollama.token_latency)
+                yield {'message': {'role': 'assistant', 'content': token}, 'done': False}
+
+        return _stream()
+
+
+def fake_fetch(data, latency):
+    """
+    A DataProvider fetch function that returns `data` after `latency` seconds.
+    """
+    def fetch(session, base_url, timeout):
+        time.sleep(latency)
+        return data
+    return fetch
+
+
+FAKE_DATA = {
+    'weather': {'location': 'New York', 'temperature': 21.5, 'humidity': 40,
+                'precipitation': 10, 'cloud_cover': 25},
+    'news': "Show HN: A voice assistant on a Raspberry Pi (example.com)\n",
+}
+
+
+def fake_detect(latency, detections=(("person", 0.998, [10., 20., 300., 400.]),
+                                     ("cup", 0.951, [320., 200., 380., 290.]))):
+    """
+    A stand-in for DetrWorker.detect that returns fixed detections after `latency` seconds.
+    """
+    def detect(image):
+        time.sleep(latency)
+        return list(detections)
+    return detect
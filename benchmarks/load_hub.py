@@ -0,0 +1,171 @@
+"""
+Load test for the hub: N simulated satellites on localhost talk to one real Hub at the same time,
+with ASR, Ollama, espeak and the HTTP providers replaced by the fakes in benchmarks/fakes.py.
+
+    python -m benchmarks.load_hub [--satellites 4] [--turns 5] [--workers 1] [--latency-scale 0.1]
+
+Each satellite says the wake word with its first command and then runs through SCRIPT, waiting for
+the hub's DONE before the next utterance as a real, half duplex satellite does. Reported per turn:
+time from END to the first SPEECH message and to DONE, then throughput, per-satellite means and
+Jain's fairness index over those means (1.0 when every satellite is served equally).
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from config import config
+
+# read when the pipeline modules are imported
+config['VISION_MODEL'] = None
+config['RAG_CACHE_DIR'] = None
+config['TTS_CACHE_DIR'] = None
+config['RESPONSE_CACHE'] = False
+
+import ollama
+from assistanttools import actions
+from assistanttools.hub import Hub
+from assistanttools.satellite_protocol import (AUDIO, DONE, END, HELLO, SPEECH, AudioCodec, pack_message,
+                                               read_message, send_json, send_message)
+from assistanttools.tracing import percentile
+from assistanttools.utils import SAMPLE_RATE
+from benchmarks.fakes import FAKE_DATA, FakeOllama, FakeTTSEngine, fake_fetch
+
+SCRIPT = [
+    "Hey Johnny Five, what's the weather like?",
+    "Tell me a joke.",
+    "What's in the news today?",
+    "What is the moon made of?",
+    "How far away is it?",
+]
+CHUNK = 480  # 30 ms, what the satellite's endpointer sends
+
+
+def utterance_audio(index, noise=0.05):
+    """
+    Stand-in audio whose length says which line of SCRIPT it is, so the fake ASR can look it up.
+    """
+    samples = int((0.5 + 0.1 * index) * SAMPLE_RATE) // CHUNK * CHUNK
+    return (np.random.default_rng(index).standard_normal(samples) * noise).astype(np.float32)
+
+
+class FakeHubTranscriber:
+    """
+    Maps an utterance back to its SCRIPT line by length, after `latency` seconds plus
+    `real_time_factor` times the length of the audio.
+    """
+
+    def __init__(self, latency=0.3, real_time_factor=0.3):
+        self.latency = latency
+        self.real_time_factor = real_time_factor
+        self.lines = {len(utterance_audio(i)): line for i, line in enumerate(SCRIPT)}
+        self.calls = 0
+
+    def __call__(self, speech, file_path=None):
+        self.calls += 1
+        time.sleep(self.latency + self.real_time_factor * len(speech) / SAMPLE_RATE)
+        return self.lines.get(len(speech), "")
+
+
+async def run_satellite(name, port, turns, codec, think_seconds):
+    """
+    Returns [(seconds to first speech, seconds to done)] for each turn.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await send_json(writer, HELLO, {'id': name, 'codec': codec})
+    encoder = AudioCodec(codec)
+    results = []
+    for turn in range(turns):
+        index = 0 if turn == 0 else 1 + (turn - 1) % (len(SCRIPT) - 1)
+        audio = utterance_audio(index)
+        encoder.reset()
+        for start in range(0, len(audio), CHUNK):
+            writer.write(pack_message(AUDIO, encoder.encode(audio[start:start + CHUNK])))
+        await send_message(writer, END)
+        ended = time.perf_counter()
+        first_speech = None
+        while True:
+            kind, _ = await read_message(reader)
+            if kind == SPEECH and first_speech is None:
+                first_speech = time.perf_counter() - ended
+            elif kind == DONE:
+                break
+        results.append((first_speech, time.perf_counter() - ended))
+        await asyncio.sleep(think_seconds)
+    writer.close()
+    return results
+
+
+def jain_index(values):
+    values = [x for x in values if x]
+    if not values:
+        return None
+    return sum(values) ** 2 / (len(values) * sum(x * x for x in values))
+
+
+def print_stats(label, values):
+    values = [x for x in values if x is not None]
+    if not values:
+        print(f"{label:<24}{'-':>10}")
+        return
+    print(f"{label:<24}{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}{max(values):>10.3f}")
+
+
+async def run_load_test(args):
+    scale = args.latency_scale
+    FakeOllama(first_token_latency=args.llm_first_token * scale,
+               token_latency=args.llm_token * scale).install(ollama)
+    for provider in actions.providers.values():
+        provider.fetch = fake_fetch(FAKE_DATA[provider.name], args.http_latency * scale)
+        provider.ttl = args.rag_ttl
+    transcriber = FakeHubTranscriber(latency=args.asr_latency * scale, real_time_factor=args.asr_rtf * scale)
+    hub = Hub(transcriber, host="127.0.0.1", port=0, workers=args.workers,
+              queue_size=config["HUB_SESSION_QUEUE"], tts=FakeTTSEngine(latency=args.tts_latency * scale),
+              store_conversations=False)
+    await hub.start()
+    port = hub.server.sockets[0].getsockname()[1]
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[run_satellite(f"satellite-{i}", port, args.turns, args.codec, args.think_seconds)
+                                     for i in range(args.satellites)])
+    wall_seconds = time.perf_counter() - start
+    await hub.close()
+    return results, wall_seconds
+
+
+def report(results, wall_seconds, args):
+    turns = sum(len(x) for x in results)
+    print(f"\n{args.satellites} satellites, {turns} turns in {wall_seconds:.2f}s with {args.workers} worker(s): "
+          f"{60 * turns / wall_seconds:.1f} turns/min")
+    print(f"\n{'latency (s)':<24}{'p50':>10}{'p95':>10}{'max':>10}")
+    print_stats("END -> first speech", [first for x in results for first, _ in x])
+    print_stats("END -> done", [done for x in results for _, done in x])
+
+    means = []
+    print(f"\n{'satellite':<24}{'mean done':>10}")
+    for i, satellite in enumerate(results):
+        means.append(sum(done for _, done in satellite) / len(satellite))
+        print(f"{f'satellite-{i}':<24}{means[-1]:>10.3f}")
+    print(f"\nJain's fairness index: {jain_index(means):.3f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate satellites against a local hub.")
+    parser.add_argument("--satellites", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=5, help="utterances per satellite")
+    parser.add_argument("--workers", type=int, default=config["HUB_WORKERS"])
+    parser.add_argument("--codec", default="adpcm", choices=["adpcm", "pcm"])
+    parser.add_argument("--think-seconds", type=float, default=0., help="pause between a reply and the next utterance")
+    parser.add_argument("--latency-scale", type=float, default=1., help="multiply every fake latency")
+    parser.add_argument("--asr-latency", type=float, default=0.3)
+    parser.add_argument("--asr-rtf", type=float, default=0.3, help="fake ASR seconds per second of audio")
+    parser.add_argument("--llm-first-token", type=float, default=0.8)
+    parser.add_argument("--llm-token", type=float, default=0.08)
+    parser.add_argument("--tts-latency", type=float, default=0.15)
+    parser.add_argument("--http-latency", type=float, default=0.3)
+    parser.add_argument("--rag-ttl", type=float, default=0., help="provider cache TTL, 0 fetches every time")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report(*asyncio.run(run_load_test(args)), args)
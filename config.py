@@ -4,19 +4,94 @@ config = {
     "TIMEOUT": 10,
     # longest amount of time the allow a phrase to continue before stopping the recording
     "PHRASE_TIME_LIMIT": 7,
+    # listen continuously and only transcribe short windows that pass an energy gate, instead of every phrase
+    "STREAMING_WAKE_WORD": True,
+    "WAKE_WINDOW_SECONDS": 2.0,
+    "PRE_ROLL_SECONDS": 1.0,  # audio kept from before the wake word so the start of the command isn't lost
+    "ENERGY_THRESHOLD": 0.01,  # minimum RMS (0 -> 1) counted as sound, raised automatically in noisy rooms
+    "VAD_BACKEND": "auto",  # webrtc, spectral or energy. auto uses webrtc if webrtcvad is installed
+    "VAD_AGGRESSIVENESS": 2,  # webrtcvad's 0 -> 3, higher rejects more noise
+    "VAD_HANGOVER_SECONDS": 0.5,  # silence after speech that ends a command
+    "VAD_MIN_SPEECH_SECONDS": 0.2,  # shorter bursts of sound are dropped before they reach whisper
     "USE_FASTER_WHISPER": False,
+    # with faster-whisper, transcribe commands while they are spoken and prefetch RAG data from the partial text
+    "STREAMING_TRANSCRIPTION": True,
+    "STREAMING_STEP_SECONDS": 0.5,  # how often the partial transcript is updated
     "WHISPER_CPP_PATH": "../whisper.cpp/",
     "WHISPER_MODEL_PATH": "../whisper.cpp/models/ggml-tin.bin",
+    "WHISPER_CPP_SERVER": True,  # keep whisper.cpp resident as a local server instead of one process per utterance
+    "WHISPER_CPP_PORT": 8910,
     "LLAMA_CPP_PATH": "../llama.cpp/",
     # "MOONDREAM_MMPROJ_PATH": "../moondream-quants/moondream2-mmproj-050824-f16.gguf",
     # "MOONDREAM_MODEL_PATH": "../moondream-quants/moondream2-050824-q8.gguf",
     "VISION_MODEL": None, # detr or moondream or None
+    "LLAVA_SERVER": True,  # keep moondream loaded in a llama.cpp server instead of running llava-cli per picture
+    "LLAVA_SERVER_PORT": 8911,
+    "CAMERA_BACKEND": "picamera2",  # picamera2 keeps the sensor open, libcamera runs libcamera-still per picture, file reads CAMERA_STUB_PATH
+    "CAMERA_RESOLUTION": [1280, 960],
+    "CAMERA_FRAME_INTERVAL": 0.5,  # seconds between frames kept in the buffer
+    "CAMERA_STUB_PATH": "assets/*.jpg",
+    # reuse the last vision result while the camera sees the same scene
+    "VISION_CACHE": True,
+    "VISION_CACHE_MAX_AGE": 30,  # seconds a result is reused for at most
+    "VISION_CACHE_MAX_DIFFERENCE": 6.,  # mean difference of 32x24 grayscale thumbnails, 0-255, allowed for the same scene
+    "VISION_CACHE_MAX_CHANGED": 0.05,  # fraction of thumbnail pixels that may change noticeably, e.g. someone walking in
+    "DETR_QUANTIZE": True,  # dynamic int8 quantization of DETR's linear layers, faster on the Pi's CPU
+    # threads per stage (None for the backend's default), so overlapping stages don't oversubscribe the Pi 5's 4 cores
+    "CPU_THREADS": {"asr": 2, "llm": 2, "vision": 2},
+    "CPU_AFFINITY": {"asr": None, "vision": None},  # cores for the whisper.cpp and llama.cpp processes, e.g. [2, 3]
+    # thread counts while "listening" (capturing and transcribing) or "responding", e.g. {"responding": {"asr": 1}}
+    "CPU_PHASE_THREADS": {},
+    # models are unloaded least recently used first to stay under this, about 3000 on a 4 GB Pi (None for no limit)
+    "MODEL_MEMORY_BUDGET_MB": 6000,
+    "MODEL_SIZE_MB": {"asr": 200, "llm": 2500, "detr": 250, "moondream": 2800},  # estimates until each is measured
     "LOCAL_MODEL": "phi3:instruct",  # better responses, higher latency
+    "OLLAMA_KEEP_ALIVE": "30m",  # how long Ollama keeps the model loaded after the last request (-1 for forever)
     "STORE_CONVERSATIONS": True,  # to save in case we you want to analyze later
-    "CONDENSE_MESSAGES": True,  # for faster response time
-    # number of messages to keep in memory (odd #s work best)
-    "TRAILING_MESSAGE_COUNT": 1,
+    # every turn is appended here, read back with `python -m assistanttools.conversation_log [conversation id]`
+    "CONVERSATION_LOG_PATH": "storage/conversations.jsonl",
+    "CONVERSATION_LOG_FLUSH_SECONDS": 2,  # turns are written in batches by a background thread
+    "CONVERSATION_LOG_MAX_MB": 10,  # the log is rotated at this size
+    "CONVERSATION_LOG_BACKUPS": 5,
+    "CONVERSATION_LOG_COMPRESS": True,  # gzip rotated logs
+    # approximate tokens of history sent to the model, the oldest turns are dropped past this (system prompt is always kept)
+    "CONTEXT_TOKEN_BUDGET": 1024,
+    "MAX_HISTORY_MESSAGES": 32,  # hard cap on remembered messages
     "SYSTEM_PROMPT": 'You are Johnny Five, a Raspbery Pi Voice Assistant. Answer questions in only a sentence.',
+    # external data for RAG, these can point at a local stand-in server for offline testing
+    "WEATHER_URL": "https://api.tomorrow.io/",
+    "WEATHER_LOCATION": "new york",
+    "NEWS_URL": "https://news.ycombinator.com/",
+    "RAG_TIMEOUT": 5,  # seconds before giving up on a request and using cached data
+    "RAG_CACHE_TTL": {"weather": 600, "news": 900},  # seconds before cached data is fetched again
+    "RAG_CACHE_DIR": "storage/rag_cache/",  # None to only cache in memory
+    "RAG_BACKGROUND_REFRESH": True,  # keep recently used data fresh in the background
+    # answers to repeated questions are spoken from here instead of being generated again
+    "RESPONSE_CACHE": True,
+    "RESPONSE_CACHE_TTL": 12 * 60 * 60,  # seconds, answers that depend on RAG data also expire when it is refreshed
+    "RESPONSE_CACHE_SIZE": 256,  # least recently used answers are dropped past this
+    "RESPONSE_CACHE_PATH": "storage/response_cache.json",  # None to only cache in memory
+    "RESPONSE_CACHE_SAVE_SECONDS": 60,  # new answers are written to disk in the background at most this often, and at exit
+    "RESPONSE_CACHE_EMBED_MODEL": None,  # an Ollama embedding model (e.g. nomic-embed-text) to also match rephrased questions
+    "RESPONSE_CACHE_SIMILARITY": 0.92,  # cosine similarity needed for a rephrased question to reuse an answer
     "SPEECH_VOLUME": 10, # 1 -> 100,
+    "SPEECH_QUEUE_SIZE": 3,  # sentences allowed to wait for espeak before the LLM stream is paused
+    "TTS_CACHE_MB": 16,  # rendered audio kept in memory for repeated phrases
+    "TTS_CACHE_DIR": "sounds/tts_cache/",  # rendered phrases are also kept here across restarts, None to disable
+    # per-turn latency traces, summarize with `python -m assistanttools.tracing`
+    "TRACE_ENABLED": False,
+    "TRACE_PATH": "storage/traces.jsonl",
+    "TRACE_MAX_MB": 5,  # the trace file is rotated at this size
+    "TRACE_BACKUP_COUNT": 3,
+    # load the models while the greeting plays, rather than before it (the first command may wait on them)
+    "BACKGROUND_WARMUP": True,
+    # `python main.py --hub` serves satellites, `python -m assistanttools.satellite HOST[:PORT]` runs one
+    "HUB_HOST": "0.0.0.0",
+    "HUB_PORT": 8920,
+    "HUB_WORKERS": 1,  # utterances processed at once across all satellites, the Pi 5 has room for one LLM stream
+    "HUB_SESSION_QUEUE": 4,  # utterances a satellite can have waiting, the oldest is dropped past this
+    "HUB_CONVERSATION_TIMEOUT": 60,  # seconds without a command before a satellite needs the wake word again
+    "SATELLITE_ID": None,  # defaults to the hostname
+    "SATELLITE_CODEC": "adpcm",  # adpcm (4 bits a sample) or pcm
     "START_WITH_MIC_CHECK": True, # if True, will start with a check to see if the microphone is working
 }
@@ -1,34 +1,117 @@
-import speech_recognition as sr
-import librosa
+import asyncio
 import os
-from assistanttools.actions import get_llm_response, message_history, preload_model
-import soundfile as sf
-import json
+import sys
+import time
+startup_began = time.perf_counter()
+from assistanttools.actions import BackgroundRefresher, get_llm_response_async, llava_server, message_history, prefetch, preload_model, providers, rewarm_model
+import threading
 import uuid
-from assistanttools.utils import check_if_exit, check_if_ignore, check_microphone, speak
+from assistanttools.camera import camera
+from assistanttools.conversation_log import conversation_log
+from assistanttools.cpu_budget import cpu_budget
+from assistanttools.microphone import MicrophoneStream
+from assistanttools.model_registry import model_registry, process_rss_mb
+from assistanttools.intents import intent_router
+from assistanttools.startup import BackgroundLoad, StartupProfile, print_import_times
+from assistanttools.streaming_asr import StreamingTranscriber
+from assistanttools.tracing import tracer
+from assistanttools.vad import create_vad
+from assistanttools.utils import check_if_ignore, check_microphone, reply_heartbeat, speak, tts_engine, write_wav
+from assistanttools.wake_word import StreamingWakeWordDetector, frame_energy, strip_wake_word
 from config import config
 
-if config['START_WITH_MIC_CHECK']:
-    check_microphone()
-
 if config['USE_FASTER_WHISPER']:
-    from faster_whisper import WhisperModel
-    model = WhisperModel("base.en")
+    def load_whisper_model():
+        from faster_whisper import WhisperModel
+        # 0 lets CTranslate2 use every core
+        return WhisperModel("base.en", cpu_threads=cpu_budget.threads("asr", base=True) or 0)
+
+    # loaded by warm_transcription at startup, or by the first transcription otherwise
+    whisper_model = BackgroundLoad(load_whisper_model, name="faster-whisper")
+
+    def warm_transcription(background=True):
+        if background:
+            whisper_model.start()
+        else:
+            whisper_model.get()
 
-    def transcribe_audio(file_path):
-        segments, _ = model.transcribe(file_path)
-        segments = list(segments)  # The transcription will actually run here.
-        transcript = " ".join([x.text for x in segments]).strip()
+    def transcribe_audio(speech, file_path=None):
+        # faster-whisper accepts a 16 kHz float32 array directly, so the file path is never needed.
+        with tracer.span("transcription"):
+            segments, _ = whisper_model.get().transcribe(speech)
+            segments = list(segments)  # The transcription will actually run here.
+            transcript = " ".join([x.text for x in segments]).strip()
         return transcript
 
+    def decode_words(audio, prompt=""):
+        """
+        Word level decode for StreamingTranscriber.
+        """
+        segments, _ = whisper_model.get().transcribe(audio, initial_prompt=prompt or None,
+                                                     word_timestamps=True,
+                                                     condition_on_previous_text=False)
+        return [(word.word.strip(), word.start, word.end) for segment in segments for word in segment.words]
+
+    # in this process, so the registry measures how much memory loading it took
+    asr_memory = None
+
 
 else:
-    from assistanttools.transcribe_gguf import transcribe_gguf
+    from assistanttools.transcribe_gguf import WhisperCppServer, transcribe_gguf
+
+    # whisper.cpp has no word level streaming here, commands are transcribed once they end
+    decode_words = None
+    whisper_server = None
+    if config["WHISPER_CPP_SERVER"]:
+        whisper_server = WhisperCppServer(whisper_cpp_path=config["WHISPER_CPP_PATH"],
+                                          model_path=config["WHISPER_MODEL_PATH"],
+                                          port=config["WHISPER_CPP_PORT"],
+                                          threads=cpu_budget.threads("asr", base=True),
+                                          preexec_fn=cpu_budget.preexec("asr"))
+
+    def start_whisper_server():
+        global whisper_server
+        try:
+            whisper_server.start()
+        except (OSError, RuntimeError, TimeoutError) as e:
+            print(f"Could not start whisper.cpp server, using the CLI instead: {e}")
+            whisper_server = None
+
+    def warm_transcription(background=True):
+        # a transcription that arrives while the server is starting waits for it
+        if whisper_server is None:
+            return
+        if background:
+            threading.Thread(target=start_whisper_server, daemon=True).start()
+        else:
+            start_whisper_server()
+
+    def asr_memory():
+        if whisper_server is None or whisper_server.process is None:
+            return None
+        return process_rss_mb(whisper_server.process.pid)
+
+    def transcribe_audio(speech, file_path=None):
+        with tracer.span("transcription"):
+            if whisper_server is not None:
+                try:
+                    return whisper_server.transcribe(speech)
+                except Exception as e:
+                    print(f"whisper.cpp server failed, falling back to the CLI: {e}")
 
-    def transcribe_audio(file_path):
-        return transcribe_gguf(whisper_cpp_path=config["WHISPER_CPP_PATH"],
-                               model_path=config["WHISPER_MODEL_PATH"],
-                               file_path=file_path)
+            # whisper.cpp's CLI only reads files, so fall back to writing the buffer once.
+            file_path = file_path or f"{config['SOUNDS_PATH']}audio.wav"
+            write_wav(file_path, speech)
+            return transcribe_gguf(whisper_cpp_path=config["WHISPER_CPP_PATH"],
+                                   model_path=config["WHISPER_MODEL_PATH"],
+                                   file_path=file_path,
+                                   threads=cpu_budget.threads("asr"),
+                                   preexec_fn=cpu_budget.preexec("asr"))
+
+
+# every command needs it, so it is never unloaded to make room for another model
+model_registry.register('asr', load=lambda: warm_transcription(background=False), unload=lambda: None,
+                        size_mb=config['MODEL_SIZE_MB']['asr'], pinned=True, measure=asr_memory)
 
 
 class WakeWordListener:
@@ -39,7 +122,9 @@ class WakeWordListener:
                  wake_word,
                  action_engine,
                  whisper_cpp_path,
-                 whisper_model_path):
+                 whisper_model_path,
+                 microphone,
+                 streaming=False):
 
         self.timeout = timeout
         self.phrase_time_limit = phrase_time_limit
@@ -48,44 +133,84 @@ class WakeWordListener:
         self.action_engine = action_engine
         self.whisper_cpp_path = whisper_cpp_path
         self.whisper_model_path = whisper_model_path
+        self.microphone = microphone
+        self.streaming = streaming
 
-    def listen_for_wake_word(self):
-        recognizer = sr.Recognizer()
-        speak("Hello. I am ready to assist you.")
-        while True:
-            with sr.Microphone() as source:
-                print("Awaiting wake word...")
-
-                try:
-                    audio = recognizer.listen(
-                        source, timeout=self.timeout // 3, phrase_time_limit=self.phrase_time_limit // 2)
-                except sr.WaitTimeoutError:
-                    continue
+    async def listen_for_wake_word(self):
+        await asyncio.to_thread(speak, "Hello. I am ready to assist you.")
+        self.microphone.clear()
+        if self.streaming:
+            await self.listen_streaming()
+        else:
+            await self.listen_phrases()
 
-            try:
-                with open(f"{self.sounds_path}audio.wav", "wb") as f:
-                    f.write(audio.get_wav_data())
+    async def listen_streaming(self):
+        detector = StreamingWakeWordDetector(transcribe=transcribe_audio,
+                                             wake_word=self.wake_word,
+                                             window_seconds=config["WAKE_WINDOW_SECONDS"],
+                                             pre_roll_seconds=config["PRE_ROLL_SECONDS"],
+                                             energy_threshold=config["ENERGY_THRESHOLD"],
+                                             max_command_seconds=self.phrase_time_limit)
+        print("Awaiting wake word...")
+        while True:
+            frame = await self.microphone.aread(timeout=1)
+            if frame is None:
+                continue
+            # the gate is cheap, but a keyword check runs ASR, so keep it off the event loop
+            utterance = await asyncio.to_thread(detector.process, frame)
+            if utterance is None:
+                continue
 
-                speech, rate = librosa.load(
-                    f"{self.sounds_path}audio.wav", sr=16000)
-                sf.write(f"{self.sounds_path}audio.wav", speech, rate)
+            # the wake word is confirmed, so make sure the LLM is loaded while the command is handled
+            rewarm_model()
+            # now transcribe everything that was said with the wake word
+            transcription = await asyncio.to_thread(
+                transcribe_audio, utterance, f"{self.sounds_path}audio.wav")
+            command = strip_wake_word(transcription, self.wake_word)
+            if check_if_ignore(command):
+                await asyncio.to_thread(speak, "Yes?")
+                self.microphone.clear()
+                command = None
+            await self.action_engine.run_second_listener(timeout=self.timeout,
+                                                         duration=self.phrase_time_limit,
+                                                         first_command=command)
+            self.microphone.clear()
+            print("Awaiting wake word...")
 
-                transcription = transcribe_audio(
-                    file_path=f"{self.sounds_path}audio.wav")
+    async def listen_phrases(self):
+        while True:
+            print("Awaiting wake word...")
+            speech = await self.microphone.alisten(timeout=self.timeout // 3,
+                                                   phrase_time_limit=self.phrase_time_limit // 2,
+                                                   energy_threshold=config["ENERGY_THRESHOLD"],
+                                                   silence_seconds=config["VAD_HANGOVER_SECONDS"])
+            if speech is None:
+                continue
 
-                if any(x in transcription.lower() for x in self.wake_word):
-                    speak("Yes?")
-                    self.action_engine.run_second_listener(timeout=self.timeout,
-                                                           duration=self.phrase_time_limit)
-                else:
-                    print(transcription)
-                    # speak("I am still listening.")
+            transcription = await asyncio.to_thread(
+                transcribe_audio, speech, f"{self.sounds_path}audio.wav")
 
-            except sr.UnknownValueError:
-                print("Could not understand audio")
+            if any(x in transcription.lower() for x in self.wake_word):
+                rewarm_model()
+                await asyncio.to_thread(speak, "Yes?")
+                self.microphone.clear()
+                await self.action_engine.run_second_listener(timeout=self.timeout,
+                                                             duration=self.phrase_time_limit)
+                self.microphone.clear()
+            else:
+                print(transcription)
+                # speak("I am still listening.")
 
 
 class ActionEngine:
+    # slow steps are cancelled after this many seconds rather than hanging the conversation. For a reply
+    # it is the longest it may go without generating or speaking anything, so long answers aren't cut off
+    step_timeout = 60
+    # talking over the assistant has to be this much louder than the speech threshold, for this long,
+    # so the assistant's own voice coming back through the microphone doesn't interrupt it
+    barge_in_ratio = 4.0
+    barge_in_seconds = 0.4
+
     def __init__(
             self,
             sounds_path,
@@ -94,6 +219,7 @@ class ActionEngine:
             ollama_model,
             message_history,
             store_conversations,
+            microphone,
             vision_model=None):
         self.sounds_path = sounds_path
         self.whisper_cpp_path = whisper_cpp_path
@@ -101,61 +227,245 @@ class ActionEngine:
         self.ollama_model = ollama_model
         self.message_history = message_history
         self.store_conversations = store_conversations
+        self.microphone = microphone
         self.vision_model = vision_model
         self.conversation_id = str(uuid.uuid4())
+        self.turn_count = 0
+        self.prefetched = set()
+        self.barge_in_frames = None
+
+    async def run_second_listener(self, timeout, duration, first_command=None):
+        if first_command:
+            tracer.start_turn(conversation_id=self.conversation_id)
+            try:
+                if not await self.handle_transcription(first_command):
+                    return
+            finally:
+                tracer.end_turn()
 
-    def run_second_listener(self, timeout, duration):
-        recognizer = sr.Recognizer()
         while True:
-            with sr.Microphone() as source:
-                print("Awaiting query...")
+            print("Awaiting query...")
+            cpu_budget.set_phase("listening")
+            stream = self.streaming_transcriber()
+            speech = await self.microphone.alisten(timeout=timeout,
+                                                   phrase_time_limit=duration,
+                                                   energy_threshold=config["ENERGY_THRESHOLD"],
+                                                   silence_seconds=config["VAD_HANGOVER_SECONDS"],
+                                                   initial_frames=self.barge_in_frames,
+                                                   stream=stream)
+            self.barge_in_frames = None
+            if speech is None:
+                if stream is not None:
+                    stream.close()
+                continue
+
+            tracer.start_turn(conversation_id=self.conversation_id)
+            tracer.record("capture", self.microphone.last_capture_seconds)
+            if self.microphone.last_resample_seconds:
+                tracer.record("resample", self.microphone.last_resample_seconds)
+            try:
                 try:
-                    audio = recognizer.listen(
-                        source, timeout=timeout, phrase_time_limit=duration)
-                except sr.WaitTimeoutError:
+                    transcription = await asyncio.wait_for(
+                        asyncio.to_thread(self.transcribe, speech, stream),
+                        timeout=self.step_timeout)
+                except asyncio.TimeoutError:
+                    print("Transcription timed out.")
                     continue
 
-            try:
-                with open(f"{self.sounds_path}command.wav", "wb") as f:
-                    f.write(audio.get_wav_data())
-                speech, rate = librosa.load(
-                    f"{self.sounds_path}command.wav", sr=16000)
-                sf.write(f"{self.sounds_path}command.wav", speech, rate)
+                if not await self.handle_transcription(transcription):
+                    return
+            finally:
+                tracer.end_turn()
 
-                transcription = transcribe_audio(
-                    file_path=f"{self.sounds_path}command.wav")
+    def streaming_transcriber(self):
+        """
+        A StreamingTranscriber for the next command, if the ASR backend supports it.
+        """
+        if not config["STREAMING_TRANSCRIPTION"] or decode_words is None:
+            return None
+        self.prefetched = set()
+        return StreamingTranscriber(decode_words,
+                                    step_seconds=config["STREAMING_STEP_SECONDS"],
+                                    on_partial=self.on_partial)
 
-                if check_if_ignore(transcription):
-                    continue
+    def transcribe(self, speech, stream=None):
+        if stream is None:
+            return transcribe_audio(speech, f"{self.sounds_path}command.wav")
+        with tracer.span("transcription"):
+            return stream.finish()
 
-                if check_if_exit(transcription):
-                    speak("Program stopped. See you later!")
-                    # set message history to empty
-                    self.message_history = [self.message_history[0]]
-                    return
+    def on_partial(self, committed, tentative):
+        """
+        Route the partial transcript, so RAG data is fetched while the user is still talking.
+        """
+        intent = intent_router.route(f"{committed} {tentative}")
+        if intent.name not in self.prefetched:
+            self.prefetched.add(intent.name)
+            prefetch(intent)
+
+    async def handle_transcription(self, transcription):
+        """
+        Respond to one command. Returns False when the conversation should end.
+        """
+        started = time.perf_counter()
+        appended = self.message_history.appended
+        with tracer.span("intent_routing"):
+            intent = intent_router.route(transcription)
+        if intent.name == 'ignore':
+            return True
+
+        if intent.name == 'exit':
+            await asyncio.to_thread(speak, "Program stopped. See you later!")
+            self.log_turn(transcription, intent, appended, started)
+            # set message history to empty
+            self.message_history.reset()
+            return False
 
-                else:
-                    os.system(f"play -v .1 sounds/notification.wav")
-                    _, self.message_history = get_llm_response(
-                        transcription, self.message_history, model_name=self.ollama_model)
+        else:
+            self.notify()
+            cpu_budget.set_phase("responding")
+            await self.respond(transcription, intent)
 
-                # save appended message history to json
-                if self.store_conversations:
-                    with open(f"storage/{self.conversation_id}.json", "w") as f:
-                        json.dump(self.message_history, f, indent=4)
+        self.log_turn(transcription, intent, appended, started)
+        return True
 
-            except sr.UnknownValueError:
-                print("Could not understand audio")
+    def log_turn(self, transcription, intent, appended, started):
+        """
+        Queue the messages this turn added for the conversation log. The write happens in the background.
+        """
+        if not self.store_conversations:
+            return
+        self.turn_count += 1
+        turn = tracer.current.get()
+        conversation_log.log_turn(self.conversation_id, self.turn_count,
+                                  self.message_history.since(appended),
+                                  transcription=transcription,
+                                  intent=intent.name,
+                                  latency={'response': round(time.perf_counter() - started, 3)},
+                                  trace=turn.id if turn is not None else None)
+
+    def notify(self):
+        os.system(f"play -v .1 sounds/notification.wav")
+
+    async def respond(self, transcription, intent=None):
+        """
+        Stream the reply while watching the microphone. If the user talks over the assistant,
+        the reply is cancelled and what they said becomes the start of the next command.
+        """
+        reply_heartbeat.beat()
+        # this turn's own flag, so a reply still running in a thread after a barge-in stays silent
+        # without affecting the next turn
+        cancelled = threading.Event()
+        response = asyncio.create_task(get_llm_response_async(
+            transcription, self.message_history, model_name=self.ollama_model, intent=intent,
+            cancelled=cancelled))
+        barge_in = asyncio.create_task(self.watch_for_barge_in())
+        while True:
+            done, _ = await asyncio.wait({response, barge_in}, timeout=1,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if done or reply_heartbeat.idle_seconds() > self.step_timeout:
+                break
+
+        if response in done:
+            barge_in.cancel()
+            _, self.message_history = response.result()
+            # drop anything the microphone picked up while the assistant was talking
+            self.microphone.clear()
+            return
+
+        response.cancel()
+        # a vision reply runs in a thread that cancelling the task doesn't stop, so tell it to stop too
+        cancelled.set()
+        tts_engine.interrupt()
+        try:
+            await response
+        except asyncio.CancelledError:
+            pass
+        if barge_in in done:
+            print("Interrupted.")
+            self.barge_in_frames = barge_in.result()
+        else:
+            print("Response timed out.")
+            barge_in.cancel()
+            self.microphone.clear()
+
+    async def watch_for_barge_in(self):
+        threshold = config["ENERGY_THRESHOLD"] * self.barge_in_ratio
+        sustain = int(self.barge_in_seconds * self.microphone.sample_rate)
+        frames = []
+        while sum(len(x) for x in frames) < sustain:
+            frame = await self.microphone.aread(timeout=0.5)
+            if frame is None:
+                continue
+            if frame_energy(frame) > threshold:
+                frames.append(frame)
+            else:
+                frames = []
+        return frames
+
+
+def run_hub():
+    """
+    python main.py --hub: serve satellites instead of listening on this device's microphone.
+    """
+    from assistanttools.hub import Hub
+    preload_model(config["LOCAL_MODEL"], background=config['BACKGROUND_WARMUP'])
+    model_registry.warm('asr', background=config['BACKGROUND_WARMUP'])
+    tts_engine.prewarm(background=config['BACKGROUND_WARMUP'])
+    if config['RAG_BACKGROUND_REFRESH']:
+        BackgroundRefresher(providers).start()
+    hub = Hub(transcribe_audio,
+              host=config["HUB_HOST"],
+              port=config["HUB_PORT"],
+              workers=config["HUB_WORKERS"],
+              queue_size=config["HUB_SESSION_QUEUE"],
+              conversation_timeout=config["HUB_CONVERSATION_TIMEOUT"],
+              model_name=config["LOCAL_MODEL"],
+              store_conversations=config["STORE_CONVERSATIONS"])
+    asyncio.run(hub.serve_forever())
 
 
 if __name__ == "__main__":
-    preload_model(config["LOCAL_MODEL"])
+    if "--hub" in sys.argv:
+        run_hub()
+        sys.exit(0)
+
+    # python main.py --profile-startup times each phase up to the greeting, then breaks down the imports
+    profile = StartupProfile(startup_began, enabled="--profile-startup" in sys.argv)
+    background = config['BACKGROUND_WARMUP']
+    # the models load in the background while the mic check and greeting run
+    with profile.phase("ollama model"):
+        preload_model(config["LOCAL_MODEL"], background=background)
+    with profile.phase("speech to text"):
+        model_registry.warm('asr', background=background)
+    with profile.phase("tts phrases"):
+        tts_engine.prewarm(background=background)
+    if config['VISION_MODEL'] == 'detr':
+        with profile.phase("detr"):
+            model_registry.warm('detr', background=background)
+    if llava_server is not None:
+        with profile.phase("llama.cpp server"):
+            model_registry.warm('moondream', background=background)
+    if config['VISION_MODEL'] is not None:
+        # open the camera now so exposure has settled before the first vision query
+        with profile.phase("camera"):
+            camera.start()
+    if config['RAG_BACKGROUND_REFRESH']:
+        BackgroundRefresher(providers).start()
+    if config['START_WITH_MIC_CHECK'] and not profile.enabled:
+        check_microphone()
+    with profile.phase("microphone"):
+        microphone = MicrophoneStream(vad=create_vad(config["VAD_BACKEND"],
+                                                     energy_threshold=config["ENERGY_THRESHOLD"],
+                                                     aggressiveness=config["VAD_AGGRESSIVENESS"]),
+                                      min_speech_seconds=config["VAD_MIN_SPEECH_SECONDS"]).start()
     action_engine = ActionEngine(sounds_path=config["SOUNDS_PATH"],
                                  whisper_cpp_path=config["WHISPER_CPP_PATH"],
                                  whisper_model_path=config["WHISPER_MODEL_PATH"],
                                  ollama_model=config["LOCAL_MODEL"],
                                  message_history=message_history,
                                  store_conversations=config["STORE_CONVERSATIONS"],
+                                 microphone=microphone,
                                  vision_model=config["VISION_MODEL"])
 
     wake_word_listener = WakeWordListener(timeout=config["TIMEOUT"],
@@ -164,6 +474,13 @@ if __name__ == "__main__":
                                           wake_word=config["WAKE_WORD"],
                                           action_engine=action_engine,
                                           whisper_cpp_path=config["WHISPER_CPP_PATH"],
-                                          whisper_model_path=config["WHISPER_MODEL_PATH"])
+                                          whisper_model_path=config["WHISPER_MODEL_PATH"],
+                                          microphone=microphone,
+                                          streaming=config["STREAMING_WAKE_WORD"])
+
+    if profile.enabled:
+        profile.report()
+        print_import_times("main")
+        sys.exit(0)
 
-    wake_word_listener.listen_for_wake_word()
+    asyncio.run(wake_word_listener.listen_for_wake_word())
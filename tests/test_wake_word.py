@@ -0,0 +1,35 @@
+import numpy as np
+from assistanttools.wake_word import StreamingWakeWordDetector, strip_wake_word
+
+WAKE_WORD = ["test", "johhny", "five", "wake"]
+
+
+def test_strip_keeps_repeated_wake_words_in_the_command():
+    assert strip_wake_word("Johnny five, what is five plus five?", WAKE_WORD) == "what is five plus five?"
+
+
+def test_strip_keeps_test_in_the_command():
+    assert strip_wake_word("Johnny five, what was the latest test score?", WAKE_WORD) == \
+        "what was the latest test score?"
+
+
+def test_strip_removes_a_repeated_wake_phrase():
+    assert strip_wake_word("Test, test. What's the weather?", WAKE_WORD) == "What's the weather?"
+
+
+def test_strip_ignores_a_wake_word_late_in_the_sentence():
+    text = "Can you tell me what two plus three is, five?"
+    assert strip_wake_word(text, WAKE_WORD) == text
+
+
+def test_gate_rises_with_steady_noise():
+    calls = []
+    detector = StreamingWakeWordDetector(lambda audio: calls.append(audio) or "", WAKE_WORD,
+                                         energy_threshold=0.01)
+    noise = np.random.default_rng(0).standard_normal(1024).astype(np.float32) * 0.02
+    for _ in range(int(60 * 16000 / 1024)):
+        detector.process(noise)
+    assert detector.threshold > 0.05
+    assert len(calls) <= 1
+    # someone talking over the fan still opens the gate
+    assert detector.is_voiced(noise * 5)